@@ -0,0 +1,143 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+COUNTER_MAX = 0xFFFF
+
+
+class AlertEngine:
+    """
+    Temporal alert state of many proctoring sessions.
+
+    Every check is debounced like the original frame counters: its counter
+    grows while the condition holds on consecutive frames, drops to zero as
+    soon as it does not, and the alert is raised once the counter exceeds
+    `threshold`.
+
+    The counters of all sessions live in one flat uint16 table of
+    max_sessions rows by len(checks) columns, so a session costs a table
+    row plus a dictionary entry.
+    Sessions are kept in least recently updated order: the ones idle for
+    more than `ttl` seconds are evicted as new updates arrive, and when the
+    table is full the least recently updated session is recycled.
+
+    Parameters
+    ----------
+    checks : list of string
+        Names of the checks tracked for every session.
+    threshold : int, optional
+        Number of consecutive frames after which a check alerts. The default is 10.
+    ttl : float, optional
+        Seconds after which an idle session is forgotten. The default is 300.
+    max_sessions : int, optional
+        Maximum number of sessions kept at once. The default is 10000.
+    """
+
+    def __init__(self, checks, threshold=10, ttl=300, max_sessions=10000):
+        self.checks = list(checks)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._index = {check: i for i, check in enumerate(self.checks)}
+        self._width = len(self.checks)
+        self._counters = array('H', bytes(2 * max_sessions * self._width))
+        self._last_seen = array('d', bytes(8 * max_sessions))
+        self._rows = OrderedDict()
+        self._free = list(range(max_sessions - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, session_id):
+        return session_id in self._rows
+
+    def _row(self, session_id, now):
+        """Return the table offset of a session, allocating a row if needed"""
+        self._evict_expired(now)
+        row = self._rows.get(session_id)
+        if row is not None:
+            self._rows.move_to_end(session_id)
+        else:
+            if not self._free:
+                # table full, recycle the least recently updated session
+                _, oldest = self._rows.popitem(last=False)
+                self._free.append(oldest)
+            row = self._free.pop()
+            start = row * self._width
+            self._counters[start:start + self._width] = array('H', bytes(2 * self._width))
+            self._rows[session_id] = row
+        self._last_seen[row] = now
+        return row * self._width
+
+    def _evict_expired(self, now):
+        deadline = now - self.ttl
+        while self._rows:
+            session_id, row = next(iter(self._rows.items()))
+            if self._last_seen[row] >= deadline:
+                break
+            del self._rows[session_id]
+            self._free.append(row)
+
+    def update(self, session_id, check, condition):
+        """
+        Record the condition of one check on a new frame
+
+        Returns
+        -------
+        alert : bool
+            True when the check has been failing for more than `threshold` frames.
+        """
+        i = self._index[check]
+        with self._lock:
+            start = self._row(session_id, time.monotonic())
+            count = min(self._counters[start + i] + 1, COUNTER_MAX) if condition else 0
+            self._counters[start + i] = count
+        return count > self.threshold
+
+    def update_many(self, session_id, conditions):
+        """
+        Record the conditions of several checks on a new frame
+
+        Parameters
+        ----------
+        session_id : hashable
+            Session the frame belongs to.
+        conditions : dict
+            Condition of each check on this frame, by check name.
+
+        Returns
+        -------
+        alerts : list of string
+            Checks currently alerting for this session.
+        """
+        counters = self._counters
+        index = self._index
+        with self._lock:
+            start = self._row(session_id, time.monotonic())
+            for check, condition in conditions.items():
+                i = start + index[check]
+                counters[i] = min(counters[i] + 1, COUNTER_MAX) if condition else 0
+            row = counters[start:start + self._width]
+        return [check for check, count in zip(self.checks, row) if count > self.threshold]
+
+    def counters(self, session_id):
+        """Return the consecutive frame count of every check of a session"""
+        with self._lock:
+            row = self._rows.get(session_id)
+            if row is None:
+                return {check: 0 for check in self.checks}
+            start = row * self._width
+            return dict(zip(self.checks, self._counters[start:start + self._width]))
+
+    def alerts(self, session_id):
+        """Return the checks currently alerting for a session"""
+        return [check for check, count in self.counters(session_id).items() if count > self.threshold]
+
+    def discard(self, session_id):
+        """Forget a session"""
+        with self._lock:
+            row = self._rows.pop(session_id, None)
+            if row is not None:
+                self._free.append(row)
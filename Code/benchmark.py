@@ -0,0 +1,155 @@
+"""
+Side by side latency and accuracy of detector configurations.
+
+    python benchmark.py objects opencv:yolov3 opencv:yolov3-tiny onnxruntime:yolov3
+    python benchmark.py faces quantized caffe
+
+Each configuration runs on every image of --images, --runs times after one
+warmup pass. Latency is the wall time of one detection per image. Without
+labelled data, accuracy is measured against the first configuration: the
+F1 score of the detections matched to its own (same class, IoU >= 0.5).
+The face benchmark also reports how long each model takes to load.
+"""
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from object_detection import YoloDetector, get_backend_factory
+from face_detection import get_face_detector, face_detector_files, find_faces
+
+
+def load_images(path, scale):
+    """Read the images of a directory, resized by `scale` like the proctoring pipeline does"""
+    images = []
+    for name in sorted(os.listdir(path)):
+        img = cv2.imread(os.path.join(path, name))
+        if img is not None:
+            images.append(cv2.resize(img, (0, 0), fx=scale, fy=scale))
+    if not images:
+        raise SystemExit(f"No image found in {path}")
+    return images
+
+
+def iou(a, b):
+    """Intersection over union of two [x, y, w, h] boxes"""
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (a[2] * a[3] + b[2] * b[3] - inter)
+
+
+def f1_score(reference, detections, threshold=0.5):
+    """F1 of detections greedily matched to reference detections of the same class"""
+    ref_boxes, ref_classes = reference
+    boxes, classes = detections
+    if not ref_boxes and not boxes:
+        return 1.0
+    unmatched = list(range(len(ref_boxes)))
+    matched = 0
+    for box, cls in zip(boxes, classes):
+        best, best_iou = None, threshold
+        for j in unmatched:
+            overlap = iou(box, ref_boxes[j])
+            if ref_classes[j] == cls and overlap >= best_iou:
+                best, best_iou = j, overlap
+        if best is not None:
+            unmatched.remove(best)
+            matched += 1
+    return 2 * matched / (len(ref_boxes) + len(boxes))
+
+
+def time_runs(detect, images, runs):
+    """Return the outputs of the last run and the latency of every call in ms"""
+    for img in images:
+        detect(img)
+    latencies = []
+    for _ in range(runs):
+        outputs = []
+        for img in images:
+            start = time.perf_counter()
+            outputs.append(detect(img))
+            latencies.append((time.perf_counter() - start) * 1000)
+    return outputs, np.array(latencies)
+
+
+def report(rows, load_times=None):
+    load_header = f"{'load ms':>10}" if load_times else ""
+    print(f"{'configuration':<32}{load_header}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'F1':>8}")
+    for name, latencies, f1 in rows:
+        load = f"{load_times[name]:>10.1f}" if load_times else ""
+        print(f"{name:<32}{load}{latencies.mean():>10.1f}{np.percentile(latencies, 50):>10.1f}"
+              f"{np.percentile(latencies, 95):>10.1f}{f1:>8.3f}")
+
+
+def benchmark_objects(args):
+    classes = open(os.path.join(args.models_dir, "yolov3.txt")).read().strip().split("\n")
+    images = load_images(args.images, args.scale)
+    rows, reference = [], None
+    for config in args.configs:
+        backend, _, model = config.partition(":")
+        try:
+            detector = YoloDetector(get_backend_factory(backend, model or "yolov3", args.models_dir)(), classes,
+                                    inputSize=args.input_size)
+            outputs, latencies = time_runs(detector.detect, images, args.runs)
+        except Exception as e:
+            print(f"{config} skipped: {e}")
+            continue
+        if reference is None:
+            reference = outputs
+        f1 = np.mean([f1_score(ref, out) for ref, out in zip(reference, outputs)])
+        rows.append((f"{config} @{detector.inputSize}", latencies, f1))
+    report(rows)
+
+
+def benchmark_faces(args):
+    images = load_images(args.images, args.scale)
+    rows, reference, load_times = [], None, {}
+    for variant in args.variants:
+        try:
+            start = time.perf_counter()
+            model = get_face_detector(*face_detector_files(variant, args.models_dir))
+            load_times[variant] = (time.perf_counter() - start) * 1000
+            outputs, latencies = time_runs(lambda img: find_faces(img, model), images, args.runs)
+        except Exception as e:
+            print(f"{variant} skipped: {e}")
+            continue
+        # [x, y, x1, y1] -> [x, y, w, h] boxes of class "face"
+        outputs = [([[x, y, x1 - x, y1 - y] for x, y, x1, y1 in faces[:, :4]], ["face"] * len(faces)) for faces in outputs]
+        if reference is None:
+            reference = outputs
+        f1 = np.mean([f1_score(ref, out) for ref, out in zip(reference, outputs)])
+        rows.append((variant, latencies, f1))
+    report(rows, load_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="student_db", help="directory of test images")
+    parser.add_argument("--models-dir", default="models")
+    parser.add_argument("--runs", type=int, default=10, help="timed passes over the images")
+    parser.add_argument("--scale", type=float, default=0.25, help="resize factor applied to the images")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    objects = commands.add_parser("objects", help="object detector backends and models")
+    objects.add_argument("configs", nargs="+", metavar="backend:model",
+                         help="e.g. opencv:yolov3, openvino:yolov3-tiny, onnxruntime:yolov3; the first is the reference")
+    objects.add_argument("--input-size", type=int, default=416)
+    objects.set_defaults(run=benchmark_objects)
+
+    faces = commands.add_parser("faces", help="face detector variants")
+    faces.add_argument("variants", nargs="*", default=["quantized", "caffe"],
+                       help="keys of face_detection.FACE_DETECTORS; the first is the reference")
+    faces.set_defaults(run=benchmark_faces)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
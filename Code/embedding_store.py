@@ -0,0 +1,311 @@
+import io
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: writers of a store are not serialized across processes
+    fcntl = None
+
+from face_index import FaceIndex
+
+# Files of a store directory: row i of the matrix is the encoding of the
+# i-th photo of the index having a face
+EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_FILE = "index.jsonl"
+# Held by the process writing the store
+LOCK_FILE = ".lock"
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def student_name(path):
+    """Name of the student of a photo, its file name without extension"""
+    return os.path.basename(path).split('.')[0]
+
+
+def encode_photo(path):
+    """
+    Face encoding of the student on a photo
+
+    Returns
+    -------
+    encoding : np.float64 or None
+        128-d encoding of the first face found, None when there is no face.
+    """
+    # face_recognition (dlib) is only needed where photos are encoded
+    import face_recognition
+    encodings = face_recognition.face_encodings(face_recognition.load_image_file(path))
+    return encodings[0] if len(encodings) > 0 else None
+
+
+class EmbeddingStore:
+    """
+    Face encodings of a directory of student photos, kept on disk.
+
+    Encoding a photo is a full CNN pass, so the encodings are saved in
+    `directory` as one float32 matrix (embeddings.npy, memory mapped when
+    loaded) and an index with one JSON line per photo: its path relative to
+    the photo directory, mtime, size, student name and row in the matrix
+    (null for a photo without a face). sync() only encodes the photos that
+    are new or whose mtime or size changed since they were encoded.
+
+    Photos enrolled or removed while the store is in use are persisted
+    incrementally: add() appends a row to the matrix and a line to the
+    index, remove() appends a line marking the photo deleted. The index is
+    read as a journal, a later line of a path replacing the earlier ones.
+    Rows left unused are dropped by the next sync().
+
+    Several processes may write the same store, e.g. the API and
+    enroll_students.py. Writers take turns on a lock file and read the
+    store again before writing, so rows and lines appended by another
+    process are kept. The files are only written in full from memory by
+    sync(), or when they are missing or corrupt.
+
+    Parameters
+    ----------
+    directory : string
+        Directory of the store, created on save.
+    dim : int, optional
+        Size of an encoding. The default is 128.
+    """
+
+    def __init__(self, directory, dim=128):
+        self.directory = directory
+        self.dim = dim
+        self.entries = []
+        self.embeddings = np.empty((0, dim), np.float32)
+        self.load()
+
+    def load(self):
+        """Read the store from disk, an incomplete or mismatched store is dropped"""
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        embeddings_path = os.path.join(self.directory, EMBEDDINGS_FILE)
+        if not (os.path.exists(index_path) and os.path.exists(embeddings_path)):
+            return self
+        try:
+            entries = {}
+            with open(index_path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry.get("deleted"):
+                        entries.pop(entry["path"], None)
+                    else:
+                        entries[entry["path"]] = entry
+            embeddings = np.load(embeddings_path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            print(f"Ignoring embedding store {self.directory}: {e}")
+            return self
+        rows = [entry["row"] for entry in entries.values() if entry["row"] is not None]
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim or max(rows, default=-1) >= len(embeddings):
+            print(f"Ignoring embedding store {self.directory}: {len(rows)} faces for {embeddings.shape} embeddings")
+            return self
+        self.entries, self.embeddings = list(entries.values()), embeddings
+        return self
+
+    def save(self):
+        """Write the store, each file is replaced at once"""
+        os.makedirs(self.directory, exist_ok=True)
+        embeddings_path = os.path.join(self.directory, EMBEDDINGS_FILE)
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(embeddings_path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(self.embeddings, dtype=np.float32))
+        with open(index_path + ".tmp", "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in self.entries)
+        os.replace(embeddings_path + ".tmp", embeddings_path)
+        os.replace(index_path + ".tmp", index_path)
+        return self
+
+    def sync(self, photos_dir, encode=encode_photo):
+        """
+        Bring the store up to date with a directory of photos and save it
+
+        Parameters
+        ----------
+        photos_dir : string
+            Directory of the student photos, named after the students.
+        encode : callable, optional
+            Returns the encoding of a photo path, None without a face. The
+            default is encode_photo. With None, photos not in the store are
+            left out of it and the store is only compacted.
+
+        Returns
+        -------
+        encoded : int
+            Number of photos encoded, the others were read from the store.
+            The store stays locked while they are encoded.
+        """
+        with self._locked():
+            self.load()
+            return self._sync(photos_dir, encode)
+
+    def _sync(self, photos_dir, encode):
+        known = {entry["path"]: entry for entry in self.entries}
+        entries, rows, encoded = [], [], 0
+        for file_name in sorted(os.listdir(photos_dir)):
+            path = os.path.join(photos_dir, file_name)
+            if not file_name.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entry = known.get(file_name)
+            if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                row = None if entry["row"] is None else self.embeddings[entry["row"]]
+            elif encode is None:
+                continue
+            else:
+                encoded += 1
+                try:
+                    row = encode(path)
+                except (OSError, ValueError) as e:
+                    print(f"Cannot encode {path}: {e}")
+                    row = None
+                else:
+                    if row is None:
+                        print(f"No face found on {path}")
+            entries.append({"path": file_name, "mtime": stat.st_mtime_ns, "size": stat.st_size,
+                            "name": student_name(file_name), "row": None if row is None else len(rows)})
+            if row is not None:
+                rows.append(row)
+
+        if encoded > 0 or len(entries) != len(self.entries) or len(rows) != len(self.embeddings):
+            self.entries = entries
+            self.embeddings = np.array(rows, np.float32).reshape(-1, self.dim)
+            try:
+                # the saved matrix is mapped back rather than kept in memory
+                self.save().load()
+            except OSError as e:
+                print(f"Cannot save embedding store {self.directory}: {e}")
+        return encoded
+
+    def add(self, photos_dir, file_name, encoding):
+        """Record the encoding of a photo saved in `photos_dir`, see add_many()"""
+        self.add_many(photos_dir, [(file_name, encoding)])
+
+    def add_many(self, photos_dir, encodings):
+        """
+        Record the encodings of photos saved in `photos_dir`
+
+        The store is read again first, then the rows and the index lines
+        are appended to its files, which are written in full only when they
+        are missing or corrupt.
+
+        Parameters
+        ----------
+        photos_dir : string
+            Directory of the photos.
+        encodings : iterable
+            (file_name, encoding) pairs, encoding None for a photo without a
+            face so it is not encoded again by sync().
+        """
+        encodings = list(encodings)
+        if not encodings:
+            return
+        with self._locked():
+            # row numbers follow the rows other processes appended since
+            self.load()
+            self._add_many(photos_dir, encodings)
+
+    def _add_many(self, photos_dir, encodings):
+        entries, rows = [], []
+        for file_name, encoding in encodings:
+            stat = os.stat(os.path.join(photos_dir, file_name))
+            entries.append({"path": file_name, "mtime": stat.st_mtime_ns, "size": stat.st_size,
+                            "name": student_name(file_name),
+                            "row": None if encoding is None else len(self.embeddings) + len(rows)})
+            if encoding is not None:
+                rows.append(encoding)
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, self.dim)
+        added = {entry["path"] for entry in entries}
+        self.entries = [e for e in self.entries if e["path"] not in added] + entries
+        if self._append_rows(rows):
+            self._append_entries(entries)
+        else:
+            self.embeddings = np.concatenate([self.embeddings, rows])
+            self.save().load()
+
+    def remove(self, name):
+        """
+        Forget the photos of a student
+
+        Returns
+        -------
+        paths : list
+            Paths of the photos removed, relative to the photo directory.
+        """
+        with self._locked():
+            self.load()
+            removed = [entry["path"] for entry in self.entries if entry["name"] == name]
+            if removed:
+                self.entries = [entry for entry in self.entries if entry["name"] != name]
+                self._append_entries([{"path": path, "deleted": True} for path in removed])
+        return removed
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock of the store until the end of a with block"""
+        os.makedirs(self.directory, exist_ok=True)
+        # the lock is released when the file is closed
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _append_entries(self, entries):
+        with open(os.path.join(self.directory, INDEX_FILE), "a") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+    def _append_rows(self, rows):
+        """Append rows to embeddings.npy in place, False when the file has to be written in full"""
+        path = os.path.join(self.directory, EMBEDDINGS_FILE)
+        if not os.path.exists(path):
+            return False
+        with open(path, "r+b") as f:
+            if np.lib.format.read_magic(f) != (1, 0):
+                return False
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            if fortran_order or dtype != np.float32 or shape[1:] != (self.dim,) or shape[0] != len(self.embeddings):
+                return False
+            if len(rows) == 0:
+                return True
+            # numpy leaves room in the header for the first dimension to grow,
+            # so the header of the longer matrix has the same size
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(header, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                          "fortran_order": False,
+                                                          "shape": (shape[0] + len(rows), self.dim)})
+            if len(header.getvalue()) != f.tell():
+                return False
+            # rows first: until the header is rewritten they are ignored
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+            f.seek(0)
+            f.write(header.getvalue())
+        self.embeddings = np.load(path, mmap_mode='r')
+        return True
+
+    @property
+    def names(self):
+        """Student name of every encoded photo, in the order of index()"""
+        return [entry["name"] for entry in self.entries if entry["row"] is not None]
+
+    def index(self):
+        """FaceIndex of the stored encodings"""
+        rows = [entry["row"] for entry in self.entries if entry["row"] is not None]
+        # a compact store is used as mapped, without copying the matrix
+        embeddings = self.embeddings if rows == list(range(len(self.embeddings))) else self.embeddings[rows]
+        return FaceIndex(embeddings, self.names, self.dim)
+
+
+def store_version(directory):
+    """Changes whenever the store in `directory` is written, None when there is no store"""
+    try:
+        stat = os.stat(os.path.join(directory, INDEX_FILE))
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
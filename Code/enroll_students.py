@@ -0,0 +1,128 @@
+"""
+Bulk enrollment of a directory of student photos into the embedding store.
+
+    python enroll_students.py --photos student_db --store embeddings --workers 8
+
+Decoding a photo, finding the face and encoding it are spread over a pool
+of worker processes. Only the photos that are new or changed since they
+were last encoded are processed. Results are written to the store every
+--flush photos, so an interrupted run keeps its progress and the next run
+resumes where it stopped. Photos that cannot be read or have no face are
+appended to the --rejects CSV file instead of aborting the run. A photo
+without a face is recorded in the store and not encoded again until it
+changes; a photo that failed with an error is retried by the next run.
+"""
+
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+
+from embedding_store import EmbeddingStore, IMAGE_EXTENSIONS, encode_photo
+
+
+def pending_photos(store, photos_dir):
+    """File names of the photos of `photos_dir` that are not in the store or changed since"""
+    known = {entry["path"]: entry for entry in store.entries}
+    pending = []
+    for file_name in sorted(os.listdir(photos_dir)):
+        path = os.path.join(photos_dir, file_name)
+        if not file_name.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(path):
+            continue
+        entry = known.get(file_name)
+        stat = os.stat(path)
+        if entry is None or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            pending.append(file_name)
+    return pending
+
+
+# Reason of the photos rejected for good, the others are retried
+NO_FACE = "no face"
+
+
+def encode_job(job):
+    """Runs in a worker: (file_name, encoding or None, reason of the rejection or None)"""
+    photos_dir, file_name = job
+    try:
+        encoding = encode_photo(os.path.join(photos_dir, file_name))
+    except Exception as e:
+        # any failure rejects the photo rather than the whole run
+        return file_name, None, f"{type(e).__name__}: {e}"
+    if encoding is None:
+        return file_name, None, NO_FACE
+    return file_name, encoding, None
+
+
+def enroll(photos_dir, store, workers=None, flush=500, rejects_path="rejects.csv"):
+    """
+    Encode the pending photos of `photos_dir` in parallel and store them
+
+    Returns
+    -------
+    encoded : int
+        Number of photos processed.
+    rejected : int
+        Number of photos without an encoding, appended to `rejects_path`.
+    """
+    pending = pending_photos(store, photos_dir)
+    workers = workers or os.cpu_count()
+    print(f"{len(pending)} photos to encode with {workers} workers, {len(store.names)} faces in the store")
+    if not pending:
+        return 0, 0
+
+    start = time.perf_counter()
+    done, rejected, batch = 0, 0, []
+    # spawn like the analysis pool of the API: workers do not inherit the
+    # threads of the parent
+    context = multiprocessing.get_context("spawn")
+    new_rejects = not os.path.exists(rejects_path)
+    # appended: the rejects of earlier runs are not encoded again
+    with context.Pool(workers) as pool, open(rejects_path, "a", newline="") as rejects_file:
+        rejects = csv.writer(rejects_file)
+        if new_rejects:
+            rejects.writerow(["path", "reason"])
+        # small chunks keep the workers busy until the end of the run
+        chunksize = max(1, min(16, len(pending) // (4 * workers)))
+        jobs = [(photos_dir, file_name) for file_name in pending]
+        for file_name, encoding, reason in pool.imap_unordered(encode_job, jobs, chunksize):
+            done += 1
+            # photos without a face are stored too, so later runs skip them;
+            # errors may be transient and are left pending
+            if reason is None or reason == NO_FACE:
+                batch.append((file_name, encoding))
+            if reason is not None:
+                rejected += 1
+                rejects.writerow([file_name, reason])
+            if len(batch) >= flush or done == len(pending):
+                store.add_many(photos_dir, batch)
+                batch = []
+                rejects_file.flush()
+                elapsed = time.perf_counter() - start
+                print(f"{done}/{len(pending)} photos, {done / elapsed:.1f} photos/s, {rejected} rejected")
+
+    elapsed = time.perf_counter() - start
+    print(f"Encoded {done} photos in {elapsed:.1f} s ({done / elapsed:.1f} photos/s), "
+          f"{done - rejected} faces added, {rejected} rejected (see {rejects_path})")
+    return done, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", default="student_db", help="directory of the student photos")
+    parser.add_argument("--store", default="embeddings", help="directory of the embedding store")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, one per core by default")
+    parser.add_argument("--flush", type=int, default=500, help="photos written to the store at once")
+    parser.add_argument("--rejects", default="rejects.csv", help="CSV file listing the photos not enrolled")
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.store)
+    enroll(args.photos, store, args.workers, args.flush, args.rejects)
+    # drops the photos deleted from the directory and the rows they left
+    # unused; the photos that failed stay pending for the next run
+    store.sync(args.photos, encode=None)
+    print(f"{len(store.names)} faces in {args.store}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,38 @@ Created on Wed Jul 29 17:52:00 2020
 @author: hp
 """
 
+import os
 import cv2
 import numpy as np
 
+# Face detector variants: model file, config file and whether it is the quantized TF model
+FACE_DETECTORS = {
+    "quantized": ("opencv_face_detector_uint8.pb", "opencv_face_detector.pbtxt", True),
+    "caffe": ("res10_300x300_ssd_iter_140000.caffemodel", "deploy.prototxt", False),
+}
+
+def face_detector_files(variant="quantized", modelsDir="models"):
+    """
+    Get the files of a face detector variant
+    
+    Parameters
+    ----------
+    variant : string, optional
+        Key of FACE_DETECTORS: "quantized" (uint8 TF model, smaller and faster to load) or "caffe". The default is "quantized".
+    modelsDir : string, optional
+        Directory holding the model files. The default is "models".
+    
+    Returns
+    -------
+    modelFile, configFile : string
+    quantized : bool
+
+    """
+    if variant not in FACE_DETECTORS:
+        raise ValueError(f"Unknown face detector: {variant}, expected one of {list(FACE_DETECTORS)}")
+    modelFile, configFile, quantized = FACE_DETECTORS[variant]
+    return os.path.join(modelsDir, modelFile), os.path.join(modelsDir, configFile), quantized
+
 def get_face_detector(modelFile=None,
                       configFile=None,
                       quantized=False):
@@ -16,10 +45,10 @@ def get_face_detector(modelFile=None,
     
     Parameters
     ----------
-    modelFile : string, optional
-        Path to model file. The default is "models/res10_300x300_ssd_iter_140000.caffemodel" or models/opencv_face_detector_uint8.pb" based on quantization.
-    configFile : string, optional
-        Path to config file. The default is "models/deploy.prototxt" or "models/opencv_face_detector.pbtxt" based on quantization.
+    modelFile : string or np.uint8, optional
+        Path to model file, or its content. The default is "models/res10_300x300_ssd_iter_140000.caffemodel" or models/opencv_face_detector_uint8.pb" based on quantization.
+    configFile : string or np.uint8, optional
+        Path to config file, or its content. The default is "models/deploy.prototxt" or "models/opencv_face_detector.pbtxt" based on quantization.
     quantization: bool, optional
         Determines whether to use quantized tf model or unquantized caffe model. The default is False.
     
@@ -29,21 +58,44 @@ def get_face_detector(modelFile=None,
 
     """
     if quantized:
-        if modelFile == None:
+        if modelFile is None:
             modelFile = "models/opencv_face_detector_uint8.pb"
-        if configFile == None:
+        if configFile is None:
             configFile = "models/opencv_face_detector.pbtxt"
         model = cv2.dnn.readNetFromTensorflow(modelFile, configFile)
         
     else:
-        if modelFile == None:
+        if modelFile is None:
             modelFile = "models/res10_300x300_ssd_iter_140000.caffemodel"
-        if configFile == None:
+        if configFile is None:
             configFile = "models/deploy.prototxt"
         model = cv2.dnn.readNetFromCaffe(configFile, modelFile)
     return model
 
-def find_faces(img, model):
+def accepts_batches(model, size=300):
+    """
+    Whether a face detection model runs one forward on several images
+
+    Graphs frozen with a batch size of 1, like the quantized TF model, fail
+    on a batched input. The check runs a forward, so it is done once on a
+    model built for it.
+    """
+    model.setInput(np.zeros((2, 3, size, size), np.float32))
+    try:
+        model.forward()
+    except cv2.error:
+        return False
+    return True
+
+def _faces(detections, w, h):
+    """SSD detections [image, label, score, x, y, x1, y1] -> (N, 5) faces in pixels"""
+    faces = np.empty((len(detections), 5), np.float32)
+    # box corners are relative to the image and may fall outside of it
+    faces[:, :4] = np.trunc(np.clip(detections[:, 3:7], 0, 1) * np.array([w, h, w, h], np.float32))
+    faces[:, 4] = detections[:, 2]
+    return faces
+
+def find_faces(img, model, confidence=0.5, size=300):
     """
     Find the faces in an image
     
@@ -53,25 +105,116 @@ def find_faces(img, model):
         Image to find faces from
     model : dnn_Net
         Face detection model
+    confidence : float, optional
+        Minimum score of a face. The default is 0.5.
+    size : int, optional
+        Side of the square input the image is resized to. The default is 300.
 
     Returns
     -------
-    faces : list
-        List of coordinates of the faces detected in the image
+    faces : np.float32
+        (N, 5) array of faces, each [x, y, x1, y1, score] with whole pixel
+        coordinates clipped to the image, by decreasing score
 
     """
     h, w = img.shape[:2]
-    blob = cv2.dnn.blobFromImage(cv2.resize(img, (300, 300)), 1.0,
-	(300, 300), (104.0, 177.0, 123.0))
+    blob = cv2.dnn.blobFromImage(cv2.resize(img, (size, size)), 1.0,
+	(size, size), (104.0, 177.0, 123.0))
+    model.setInput(blob)
+    detections = model.forward()[0, 0]
+    return _faces(detections[detections[:, 2] > confidence], w, h)
+
+def find_faces_batch(imgs, model, confidence=0.5, size=300):
+    """
+    Find the faces in several images with a single forward pass, for models
+    that accept batches (see accepts_batches)
+
+    Parameters
+    ----------
+    imgs : list of np.uint8
+        Images to find faces from
+    model : dnn_Net
+        Face detection model
+    confidence : float, optional
+        Minimum score of a face. The default is 0.5.
+    size : int, optional
+        Side of the square input the image is resized to. The default is 300.
+
+    Returns
+    -------
+    faces : list of np.float32
+        One (N, 5) array of faces per image, as returned by find_faces
+
+    """
+    blob = cv2.dnn.blobFromImages([cv2.resize(img, (size, size)) for img in imgs], 1.0,
+	(size, size), (104.0, 177.0, 123.0))
     model.setInput(blob)
-    res = model.forward()
+    detections = model.forward()[0, 0]
+    # detections of every image share one output, column 0 holds the image index
+    detections = detections[detections[:, 2] > confidence]
     faces = []
-    for i in range(res.shape[2]):
-        confidence = res[0, 0, i, 2]
-        if confidence > 0.5:
-            box = res[0, 0, i, 3:7] * np.array([w, h, w, h])
-            (x, y, x1, y1) = box.astype("int")
-            faces.append([x, y, x1, y1])
+    for n, img in enumerate(imgs):
+        h, w = img.shape[:2]
+        faces.append(_faces(detections[detections[:, 0] == n], w, h))
+    return faces
+
+def person_roi(box, shape, upper=0.6):
+    """
+    Region of a frame where the face of a detected person is
+
+    Parameters
+    ----------
+    box : list
+        [x, y, w, h] box of the person, as returned by YoloDetector
+    shape : tuple
+        Shape of the frame
+    upper : float, optional
+        Part of the box height, from its top, holding the head. The default is 0.6.
+
+    Returns
+    -------
+    roi : tuple
+        (x, y, x1, y1) of the region clipped to the frame, the whole frame
+        when the box lies outside of it
+
+    """
+    h, w = shape[:2]
+    x, y = max(int(box[0]), 0), max(int(box[1]), 0)
+    x1 = min(int(box[0] + box[2]), w)
+    y1 = min(int(box[1] + box[3] * upper), h)
+    if x1 <= x or y1 <= y:
+        return 0, 0, w, h
+    return x, y, x1, y1
+
+def find_faces_in_roi(img, model, roi, confidence=0.5, size=300):
+    """
+    Find the faces inside a region of an image
+
+    The region is resized to the input of the model instead of the whole
+    image, so faces get more input pixels and a smaller `size` may do.
+
+    Parameters
+    ----------
+    img : np.uint8
+        Image to find faces from
+    model : dnn_Net
+        Face detection model
+    roi : tuple
+        (x, y, x1, y1) region to search, e.g. from person_roi
+    confidence : float, optional
+        Minimum score of a face. The default is 0.5.
+    size : int, optional
+        Side of the square input the region is resized to. The default is 300.
+
+    Returns
+    -------
+    faces : np.float32
+        Faces as returned by find_faces, in the coordinates of the image
+
+    """
+    x, y, x1, y1 = roi
+    faces = find_faces(img[y:y1, x:x1], model, confidence, size)
+    faces[:, :4] += np.array([x, y, x, y], np.float32)
     return faces
 
 def draw_faces(img, faces):
@@ -82,14 +225,14 @@ def draw_faces(img, faces):
     ----------
     img : np.uint8
         Image to draw faces on
-    faces : List of face coordinates
-        Coordinates of faces to draw
+    faces : np.float32
+        Faces to draw, as returned by find_faces
 
     Returns
     -------
     None.
 
     """
-    for x, y, x1, y1 in faces:
+    for x, y, x1, y1 in faces[:, :4].astype(int):
         cv2.rectangle(img, (x, y), (x1, y1), (0, 0, 255), 3)
         
\ No newline at end of file
@@ -0,0 +1,219 @@
+import numpy as np
+
+# Distance under which face_recognition considers two faces the same person
+TOLERANCE = 0.6
+
+# Rows of the database compared with the centroids at once while clustering
+CHUNK_ROWS = 65536
+
+
+def _squared_distances(queries, vectors, vector_norms):
+    """Squared Euclidean distances between every query and every vector, with one matmul"""
+    query_norms = np.einsum("ij,ij->i", queries, queries)
+    d2 = query_norms[:, None] - 2 * queries @ vectors.T + vector_norms[None, :]
+    return np.maximum(d2, 0, out=d2)
+
+
+def _top_k(d2, k):
+    """Indices and squared distances of the k smallest values of every row, by increasing distance"""
+    if k < d2.shape[1]:
+        part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(d2.shape[1]), d2.shape)
+    part_d2 = np.take_along_axis(d2, part, axis=1)
+    order = np.argsort(part_d2, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_d2, order, axis=1)
+
+
+class FaceIndex:
+    """
+    Face embeddings of the known students, searched by Euclidean distance.
+
+    The embeddings are the rows of one contiguous float32 matrix and the
+    names the matching entries of a parallel array. An exact search takes
+    the distances of every query to every row from a single matrix
+    product (|q|^2 - 2 q.e + |e|^2, the row norms being computed once),
+    then keeps the k nearest rows with a partial sort.
+
+    For very large rosters, build_ivf() clusters the rows with k-means
+    (an inverted file index). A search then only compares the queries with
+    the rows of the `n_probe` clusters nearest to them. This is
+    approximate: a match lying in another cluster is missed.
+
+    An index is never modified once built: added() and removed() return a
+    new index, so threads searching the current one are never blocked and
+    the new one is published by swapping a reference.
+
+    Parameters
+    ----------
+    embeddings : array_like, optional
+        (N, dim) face encodings, e.g. from face_recognition.face_encodings.
+    names : sequence of str, optional
+        Name of the student of every row.
+    dim : int, optional
+        Size of an encoding. The default is 128.
+    """
+
+    def __init__(self, embeddings=None, names=None, dim=128):
+        if embeddings is None:
+            embeddings = np.empty((0, dim), np.float32)
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, dim)
+        self.names = np.array([] if names is None else list(names), dtype=object)
+        if len(self.names) != len(self.embeddings):
+            raise ValueError(f"{len(self.names)} names for {len(self.embeddings)} embeddings")
+        self._norms = np.einsum("ij,ij->i", self.embeddings, self.embeddings)
+        self._centroids = None
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    @property
+    def dim(self):
+        return self.embeddings.shape[1]
+
+    def build_ivf(self, n_lists=None, n_probe=8, iterations=10, sample=None, seed=0, like=None):
+        """
+        Cluster the rows so searches only scan the nearest clusters
+
+        Parameters
+        ----------
+        n_lists : int, optional
+            Number of clusters. The default is 4 * sqrt(N).
+        n_probe : int, optional
+            Clusters scanned per query. The default is 8.
+        iterations : int, optional
+            k-means iterations. The default is 10.
+        sample : int, optional
+            Rows the centroids are trained on. The default is 64 per cluster.
+        seed : int, optional
+            Seed of the random initialisation. The default is 0.
+        like : FaceIndex, optional
+            IVF index whose centroids and n_probe are reused instead of
+            training new ones, e.g. the previous index of a changed roster.
+        """
+        if len(self) == 0:
+            return self
+        if like is not None and like._centroids is not None:
+            self._set_ivf(like._centroids, self._assign(self.embeddings, like._centroids), like.n_probe)
+            return self
+        n_lists = max(1, min(n_lists or int(4 * np.sqrt(len(self))), len(self)))
+        rng = np.random.default_rng(seed)
+        sample = min(len(self), sample or 64 * n_lists)
+        train = self.embeddings[rng.choice(len(self), sample, replace=False)]
+        centroids = train[rng.choice(sample, n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assigned = self._assign(train, centroids)
+            order, offsets = self._group(assigned, n_lists)
+            filled = np.flatnonzero(offsets[1:] > offsets[:-1])
+            # mean of the rows of every non empty cluster, empty ones keep their centroid
+            sums = np.add.reduceat(train[order], offsets[filled], axis=0)
+            centroids[filled] = sums / (offsets[filled + 1] - offsets[filled])[:, None]
+
+        self._set_ivf(centroids, self._assign(self.embeddings, centroids), min(n_probe, n_lists))
+        return self
+
+    def _set_ivf(self, centroids, assigned, n_probe):
+        self._centroids = centroids
+        self._centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        self._assigned = assigned
+        self._order, self._offsets = self._group(assigned, len(centroids))
+        self.n_probe = n_probe
+
+    def added(self, embeddings, names):
+        """
+        Return a new index holding the faces of this one and new faces
+
+        With an IVF index, the new faces join the clusters of their nearest
+        centroid; the centroids are not trained again.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        index = FaceIndex(np.concatenate([self.embeddings, embeddings]),
+                          list(self.names) + list(names), self.dim)
+        if self._centroids is not None:
+            assigned = np.concatenate([self._assigned, self._assign(embeddings, self._centroids)])
+            index._set_ivf(self._centroids, assigned, self.n_probe)
+        return index
+
+    def removed(self, name):
+        """Return a new index without the faces of a student"""
+        keep = self.names != name
+        index = FaceIndex(self.embeddings[keep], self.names[keep], self.dim)
+        if self._centroids is not None:
+            index._set_ivf(self._centroids, self._assigned[keep], self.n_probe)
+        return index
+
+    @staticmethod
+    def _group(assigned, n_lists):
+        """Rows sorted by cluster, cluster c holding rows order[offsets[c]:offsets[c + 1]]"""
+        order = np.argsort(assigned, kind="stable")
+        offsets = np.zeros(n_lists + 1, np.int64)
+        np.cumsum(np.bincount(assigned, minlength=n_lists), out=offsets[1:])
+        return order, offsets
+
+    @staticmethod
+    def _assign(vectors, centroids):
+        """Nearest centroid of every vector, CHUNK_ROWS vectors at a time"""
+        norms = np.einsum("ij,ij->i", centroids, centroids)
+        assigned = np.empty(len(vectors), np.int64)
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            chunk = vectors[start:start + CHUNK_ROWS]
+            assigned[start:start + len(chunk)] = _squared_distances(chunk, centroids, norms).argmin(axis=1)
+        return assigned
+
+    def search(self, queries, k=1):
+        """
+        Find the nearest known faces of face encodings
+
+        Parameters
+        ----------
+        queries : array_like
+            One (dim,) encoding or (Q, dim) encodings.
+        k : int, optional
+            Number of neighbours returned per query. The default is 1.
+
+        Returns
+        -------
+        distances : np.float32
+            (Q, k) Euclidean distances, increasing along each row. Rows have
+            fewer than k columns when the index holds fewer faces.
+        indices : np.int64
+            (Q, k) rows of the neighbours in the index.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty((len(queries), 0), np.float32), np.empty((len(queries), 0), np.int64)
+        if self._centroids is None:
+            indices, d2 = _top_k(_squared_distances(queries, self.embeddings, self._norms), k)
+            return np.sqrt(d2), indices
+
+        distances = np.full((len(queries), k), np.inf, np.float32)
+        indices = np.full((len(queries), k), -1, np.int64)
+        probes, _ = _top_k(_squared_distances(queries, self._centroids, self._centroid_norms), self.n_probe)
+        for q, clusters in enumerate(probes):
+            rows = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in clusters])
+            if len(rows) == 0:
+                continue
+            found, d2 = _top_k(_squared_distances(queries[q:q + 1], self.embeddings[rows], self._norms[rows]),
+                               min(k, len(rows)))
+            distances[q, :found.shape[1]] = np.sqrt(d2[0])
+            indices[q, :found.shape[1]] = rows[found[0]]
+        return distances, indices
+
+    def identify(self, encoding, tolerance=TOLERANCE):
+        """
+        Name of the student a face encoding belongs to
+
+        Returns
+        -------
+        name : str
+            Name of the nearest known face, "Unknown" when it is further
+            than `tolerance` or no face is known.
+        distance : float
+            Distance to the nearest known face, inf when none is known.
+        """
+        distances, indices = self.search(encoding, k=1)
+        if distances.shape[1] == 0 or indices[0, 0] < 0:
+            return "Unknown", float("inf")
+        distance = float(distances[0, 0])
+        return (self.names[indices[0, 0]] if distance <= tolerance else "Unknown"), distance
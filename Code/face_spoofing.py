@@ -1,13 +1,15 @@
 import numpy as np
 import cv2
 import joblib
-import dlib
-
-clf = joblib.load('models/face_spoofing.pkl')
+from frame_context import as_context
 
 sample_number = 1
 count = 0
-measures = np.zeros(sample_number, dtype=np.float)
+
+def get_spoof_classifier(modelFile=None):
+    if modelFile == None:
+        modelFile = 'models/face_spoofing.pkl'
+    return joblib.load(modelFile)
 
 def calc_hist(img):
 
@@ -20,19 +22,21 @@ def calc_hist(img):
 
 
 
-def face_spoof(img, face):
+# img is an image or a FrameContext
+def face_spoof(img, face, clf):
+    context = as_context(img)
     x = face[0]*4
     y = face[1]*4
     x1 = face[2]*4
     y1 = face[3]*4
 
-    measures[count%sample_number]=0
+    # local buffer, the classifier can be called from several threads
+    measures = np.zeros(sample_number, dtype=float)
     
-    roi = img[y:y1, x:x1]
     point = (0,0)
     
-    img_ycrcb = cv2.cvtColor(roi, cv2.COLOR_BGR2YCR_CB)
-    img_luv = cv2.cvtColor(roi, cv2.COLOR_BGR2LUV)
+    img_ycrcb = context.crop((x, y, x1, y1), cv2.COLOR_BGR2YCR_CB)
+    img_luv = context.crop((x, y, x1, y1), cv2.COLOR_BGR2LUV)
 
     ycrcb_hist = calc_hist(img_ycrcb)
     luv_hist = calc_hist(img_luv)
@@ -0,0 +1,64 @@
+import cv2
+
+
+class FrameContext:
+    """
+    A frame and the images derived from it, each computed at most once.
+
+    Several stages of the pipeline need the same conversions of a frame:
+    the motion gate and the tracker both use its grayscale version, the
+    eye tracker converts it once per eye and dlib once more. Stages take a
+    context instead of the raw image and read the views they need from it;
+    a view is computed on first access and reused by the following stages.
+
+    A resized frame is itself a context, so its own views are shared too.
+    Other views, e.g. the input blob of a model, are memoized with derive().
+    A context belongs to the thread processing its frame.
+
+    Parameters
+    ----------
+    image : np.uint8
+        BGR frame.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self._views = {}
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def derive(self, key, compute):
+        """Return the view stored under `key`, computed by compute() on first use"""
+        if key not in self._views:
+            self._views[key] = compute()
+        return self._views[key]
+
+    @property
+    def gray(self):
+        return self.derive("gray", lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def rgb(self):
+        return self.derive("rgb", lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB))
+
+    def resized(self, factor):
+        """Context of the frame resized by `factor`"""
+        if factor == 1:
+            return self
+        return self.derive(("resized", factor),
+                           lambda: FrameContext(cv2.resize(self.image, (0, 0), fx=factor, fy=factor)))
+
+    def crop(self, box, code=None):
+        """Region [x, y, x1, y1] of the frame, converted with a cv2.COLOR_BGR2* code when given"""
+        x, y, x1, y1 = (int(v) for v in box)
+        if code is None:
+            return self.image[y:y1, x:x1]
+        return self.derive(("crop", x, y, x1, y1, code),
+                           lambda: cv2.cvtColor(self.image[y:y1, x:x1], code))
+
+
+def as_context(frame):
+    """Return the FrameContext of a frame, contexts are returned as they are"""
+    return frame if isinstance(frame, FrameContext) else FrameContext(frame)
@@ -2,13 +2,12 @@ import numpy as np
 import os
 import sys
 import cv2
-from tensorflow.keras.models import load_model
 from glob import glob
 import random
-from tensorflow.keras.utils import Sequence
 from random import randrange
 import json
 import math
+from frame_context import as_context
 #import pandas as pd
 
 
@@ -16,6 +15,8 @@ import math
 
 
 def load_hp_model(oModelPath):
+    # tensorflow is only imported once a model is actually loaded
+    from tensorflow.keras.models import load_model
     oHpModel = load_model(oModelPath)
     return oHpModel
 
@@ -99,34 +100,49 @@ def expand_bbox(oBBox,oImage):
 
     return bbox
 
-#input image should be in BGR FORMAT
+#input image should be in BGR FORMAT, or a FrameContext of it
 #input face box should be in [x1,y1,x2,y2] in other words [left, top,right,bottom]
-def headpose_inference(oModel,oImage,face):
+#oScale maps the face box to the coordinates of the image
+def headpose_crop(oImage,face,oScale=4):
+    
+    oContext = as_context(oImage)
+    oImage = oContext.image
     
-    left = face[0]*4
-    top = face[1]*4
-    right = face[2]*4
-    bottom = face[3]*4
+    left = int(face[0]*oScale)
+    top = int(face[1]*oScale)
+    right = int(face[2]*oScale)
+    bottom = int(face[3]*oScale)
 
     oBBox = (left, top,right,bottom)
     
     #expand bounding box
     oBboxExpanded = expand_bbox(oBBox,oImage)
 
-    oImage = cv2.cvtColor(oImage, cv2.COLOR_BGR2RGB)
     #crop face region
-    crop = oImage[oBboxExpanded[1]:oBboxExpanded[3], oBboxExpanded[0]:oBboxExpanded[2]]
-    #print(crop.shape)
+    crop = oContext.crop(oBboxExpanded, cv2.COLOR_BGR2RGB)
     #resize crop
     crop = cv2.resize(crop, (100,100))
-    crop = np.reshape(crop,(-1,100,100,3))
+    
+    return crop,oBboxExpanded
+
+#crops are 100x100 RGB face crops from headpose_crop, predicted in one batch
+def headpose_predict(oModel,crops):
+    
     #normalize
-    crop = crop/255.0
+    oCropsNp = np.stack(crops)/255.0
     #predict headpose 
-    oHpAngles = oModel.predict(crop)
+    oHpAngles = np.asarray(oModel.predict_on_batch(oCropsNp))
     #convert radian to degree
-    oHpAngles = oHpAngles[0] * 180/np.pi
+    return oHpAngles * 180/np.pi
+
+def headpose_inference(oModel,oImage,face):
+    
+    crop,oBboxExpanded = headpose_crop(oImage,face)
+    oHpAngles = headpose_predict(oModel,[crop])[0]
     
     return oHpAngles,oBboxExpanded
 
-
+#True when the angles show the student looking away from the screen
+def is_looking_away(oAnglesNp):
+    return (round(oAnglesNp[0],1) not in [0.0,-1.0,-1.1,-1.2,-1.3,-1.4,-1.5,-1.6,-1.7] and 
+            round(oAnglesNp[1],0) not in [0.0,1.0,2.0,3.0,4.0,5.0])
@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class InferenceBatcher:
+    """
+    Runs the inference calls of concurrent requests as batched forwards.
+
+    A single frame leaves most of the CPU's vector units idle during a
+    forward pass. Callers hand their inputs to submit() from any thread; a
+    dedicated thread, the only one touching the model, waits up to `window`
+    seconds after the first pending call for others to arrive (or until
+    `max_batch` inputs are collected), runs `run_batch` once on all of
+    them and hands every caller its own outputs.
+
+    Parameters
+    ----------
+    run_batch : callable
+        Takes a list of inputs and returns the list of their outputs.
+    max_batch : int, optional
+        Number of inputs after which a batch is run without waiting. The default is 16.
+    window : float, optional
+        Seconds to wait for more calls once one is pending. The default is 0.005.
+    name : string, optional
+        Name of the batching thread. The default is "batcher".
+    on_batch : callable, optional
+        Called with the size of every batch run, e.g. to record metrics.
+    """
+
+    def __init__(self, run_batch, max_batch=16, window=0.005, name="batcher", on_batch=None):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.window = window
+        self.on_batch = on_batch
+        self._closed = False
+        self._calls = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        """
+        Run the model on `items` within the next batch and wait for the outputs
+
+        Returns
+        -------
+        outputs : list
+            Output of every input, in order.
+        """
+        if len(items) == 0:
+            return []
+        if self._closed:
+            raise RuntimeError("InferenceBatcher is closed")
+        future = Future()
+        self._calls.put((list(items), future))
+        return future.result()
+
+    def close(self):
+        """Stop the batching thread once the pending calls are run"""
+        self._closed = True
+        self._calls.put(None)
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            call = self._calls.get()
+            if call is None:
+                return
+            calls, size = [call], len(call[0])
+            deadline = time.monotonic() + self.window
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    call = self._calls.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if call is None:
+                    # run what was collected, then stop
+                    self._calls.put(None)
+                    break
+                calls.append(call)
+                size += len(call[0])
+            self._run(calls, size)
+
+    def _run(self, calls, size):
+        items = [item for call_items, _ in calls for item in call_items]
+        try:
+            outputs = self.run_batch(items)
+        except Exception as e:
+            for _, future in calls:
+                future.set_exception(e)
+            return
+        if self.on_batch is not None:
+            self.on_batch(size)
+        start = 0
+        for call_items, future in calls:
+            future.set_result(outputs[start:start + len(call_items)])
+            start += len(call_items)
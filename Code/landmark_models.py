@@ -3,6 +3,7 @@ import numpy as np
 import dlib
 from math import hypot
 from scipy.spatial import distance as dist
+from frame_context import as_context
 
 def midpoint(p1 ,p2):
     return int((p1.x + p2.x)/2), int((p1.y + p2.y)/2)
@@ -22,8 +23,9 @@ def get_blinking_ratio(eye_points, frame, facial_landmarks):
 
 
 
+#frame is an image or a FrameContext, whose grayscale version is shared by both eyes
 def get_gaze_ratio(eye_points, frame, facial_landmarks):
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = as_context(frame).gray
     
     ##################### Keep only eye region in gray image. Remove rest. ##################################
     left_eye_region = np.array([(facial_landmarks.part(eye_points[0]).x, facial_landmarks.part(eye_points[0]).y),
@@ -33,7 +35,7 @@ def get_gaze_ratio(eye_points, frame, facial_landmarks):
                                 (facial_landmarks.part(eye_points[4]).x, facial_landmarks.part(eye_points[4]).y),
                                 (facial_landmarks.part(eye_points[5]).x, facial_landmarks.part(eye_points[5]).y)], np.int32)
     # cv2.polylines(frame, [left_eye_region], True, (0, 0, 255), 2)
-    height, width, _ = frame.shape
+    height, width = gray.shape
     mask = np.zeros((height, width), np.uint8)
     cv2.polylines(mask, [left_eye_region], True, 255, 2)
     cv2.fillPoly(mask, [left_eye_region], 255)
@@ -0,0 +1,222 @@
+import os
+import cv2
+import numpy as np
+
+from object_detection import YoloDetector, get_backend_factory
+from net_pool import NetPool, read_buffers
+from face_detection import get_face_detector, face_detector_files, find_faces, accepts_batches
+from face_spoofing import get_spoof_classifier
+from headpose_estimation import load_hp_model, headpose_predict
+from embedding_store import EmbeddingStore, store_version
+
+# Rosters from this size are searched with the approximate (IVF) face index
+IVF_MIN_FACES = 50000
+
+
+class ModelRegistry:
+    """
+    Owns every detector used by the proctoring pipeline.
+
+    Models are loaded once and then borrowed by the code that analyses
+    frames. The OpenCV models (face cascade, face detector, YOLO) are
+    NetPools of `pool_size` instances, so that many threads can share one
+    registry; each inference checks an instance out. When the DNN models
+    are run by a batching thread instead (`batched`), only that thread
+    uses them and they are loaded once. `face_batches` tells whether the
+    face detector accepts batched inputs; when it does not, it is not
+    batched and keeps `pool_size` instances. A model whose files
+    are missing or fail to load is left as None and the reason is kept in
+    `errors`, so callers can fall back to a cheaper detector instead of
+    failing the whole request.
+
+    Parameters
+    ----------
+    models_dir : string, optional
+        Directory holding the model files. The default is "models".
+    detection_budget : float, optional
+        Forward time budget in seconds of the object detector, which then
+        adapts its input size to the load. The default is None (fixed 416 input).
+    pool_size : int, optional
+        Instances of each OpenCV model, the number of threads that can run
+        it at once. The default is 1.
+    num_threads : int, optional
+        Threads of OpenCV's parallel backend, see NetPool. The default is None.
+    batched : bool, optional
+        Whether the face detector and YOLO are only run by one batching
+        thread each, e.g. app.InferenceBatcher; their pools then hold a
+        single instance. The default is False.
+    detector_backend : string, optional
+        Backend running the object detector, one of object_detection.BACKENDS. The default is "opencv".
+    detector_model : string, optional
+        Name of the object detection model files, e.g. "yolov3-tiny". The default is "yolov3".
+    face_detector : string, optional
+        Face detector variant, a key of face_detection.FACE_DETECTORS. The default is "quantized".
+    embeddings_dir : string, optional
+        EmbeddingStore of the enrolled students, searched to identify faces.
+        Needs the face_recognition package. The default is None (faces are
+        not identified).
+    """
+
+    def __init__(self, models_dir="models", detection_budget=None, pool_size=1, num_threads=None,
+                 detector_backend="opencv", detector_model="yolov3", face_detector="quantized",
+                 embeddings_dir=None, batched=False):
+        self.models_dir = models_dir
+        self.detection_budget = detection_budget
+        self.pool_size = pool_size
+        self.num_threads = num_threads
+        self.detector_backend = detector_backend
+        self.detector_model = detector_model
+        self.face_detector = face_detector
+        self.embeddings_dir = embeddings_dir
+        self.batched = batched
+        self.face_cascade = None
+        self.face_model = None
+        self.face_batches = False
+        self.yolo = None
+        self.spoof_clf = None
+        self.headpose_model = None
+        self.face_index = None
+        self.face_index_version = None
+        self.errors = {}
+
+    def _path(self, name):
+        return os.path.join(self.models_dir, name)
+
+    def _pool(self, create, batched=False):
+        # a batched model is only run by its batching thread
+        return NetPool(create, 1 if batched and self.batched else self.pool_size, self.num_threads)
+
+    def load(self):
+        """Load all models, recording the ones that could not be loaded."""
+        try:
+            cascade_file = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+            if cv2.CascadeClassifier(cascade_file).empty():
+                raise IOError("haarcascade_frontalface_default.xml not found")
+            self.face_cascade = self._pool(lambda: cv2.CascadeClassifier(cascade_file))
+        except Exception as e:
+            self.face_cascade = None
+            self.errors["face_cascade"] = str(e)
+
+        try:
+            # files are read once, every instance is built from the same buffers
+            model_file, config_file, quantized = face_detector_files(self.face_detector, self.models_dir)
+            model, config = read_buffers(model_file, config_file)
+            create = lambda: get_face_detector(modelFile=model, configFile=config, quantized=quantized)
+            self.face_batches = accepts_batches(create())
+            self.face_model = self._pool(create, batched=self.face_batches)
+        except Exception as e:
+            self.face_model = None
+            self.errors["face_detection"] = str(e)
+
+        try:
+            create_backend = get_backend_factory(self.detector_backend, self.detector_model, self.models_dir)
+            # every model is trained on the COCO classes listed in yolov3.txt
+            classes = open(self._path("yolov3.txt")).read().strip().split("\n")
+            self.yolo = self._pool(lambda: YoloDetector(create_backend(), classes,
+                                                        latencyBudget=self.detection_budget), batched=True)
+        except Exception as e:
+            self.yolo = None
+            self.errors["object_detection"] = str(e)
+
+        try:
+            self.spoof_clf = get_spoof_classifier(self._path("face_spoofing.pkl"))
+        except Exception as e:
+            self.spoof_clf = None
+            self.errors["face_spoofing"] = str(e)
+
+        try:
+            self.headpose_model = load_hp_model(self._path("Headpose_customARC_ZoomShiftNoise.hdf5"))
+        except Exception as e:
+            self.headpose_model = None
+            self.errors["head_pose"] = str(e)
+
+        if self.embeddings_dir is not None:
+            try:
+                # encodings of the faces to identify are computed with face_recognition
+                import face_recognition
+                self._load_face_index()
+            except Exception as e:
+                self.face_index = None
+                self.errors["face_recognition"] = str(e)
+
+        for name, error in self.errors.items():
+            print(f"Model '{name}' not loaded: {error}")
+        return self
+
+    def _load_face_index(self):
+        previous = self.face_index
+        self.face_index_version = store_version(self.embeddings_dir)
+        face_index = EmbeddingStore(self.embeddings_dir).index()
+        if len(face_index) >= IVF_MIN_FACES:
+            face_index.build_ivf(like=previous)
+        self.face_index = face_index
+
+    def refresh_face_index(self):
+        """
+        Reload the face index when its store was written since it was loaded.
+
+        Registries of other processes do not see the students enrolled or
+        removed through the API process until they reload the store.
+        """
+        if self.face_index is not None and store_version(self.embeddings_dir) != self.face_index_version:
+            self._load_face_index()
+
+    def warmup(self):
+        """
+        Run every loaded model once on a blank frame.
+
+        The first inference of an OpenCV DNN net allocates its buffers and
+        picks its kernels, so doing it at startup keeps that cost out of the
+        first request. A model that fails here is disabled.
+        """
+        frame = np.zeros((480, 640, 3), np.uint8)
+
+        if self.face_cascade is not None:
+            for face_cascade in self.face_cascade.instances:
+                face_cascade.detectMultiScale(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), 1.1, 4)
+
+        if self.face_model is not None:
+            try:
+                for face_model in self.face_model.instances:
+                    find_faces(frame, face_model)
+            except Exception as e:
+                self.face_model = None
+                self.errors["face_detection"] = str(e)
+                print(f"Model 'face_detection' disabled after warmup: {e}")
+
+        if self.yolo is not None:
+            try:
+                for yolo in self.yolo.instances:
+                    yolo.detect(frame)
+            except Exception as e:
+                self.yolo = None
+                self.errors["object_detection"] = str(e)
+                print(f"Model 'object_detection' disabled after warmup: {e}")
+
+        if self.spoof_clf is not None:
+            try:
+                self.spoof_clf.predict_proba(np.zeros((1, 6 * 256)))
+            except Exception as e:
+                self.spoof_clf = None
+                self.errors["face_spoofing"] = str(e)
+                print(f"Model 'face_spoofing' disabled after warmup: {e}")
+
+        if self.headpose_model is not None:
+            try:
+                headpose_predict(self.headpose_model, [np.zeros((100, 100, 3), np.uint8)])
+            except Exception as e:
+                self.headpose_model = None
+                self.errors["head_pose"] = str(e)
+                print(f"Model 'head_pose' disabled after warmup: {e}")
+        return self
+
+    def status(self):
+        """Return which models are available."""
+        return {
+            "face_cascade": self.face_cascade is not None,
+            "face_detection": self.face_model is not None,
+            "object_detection": self.yolo is not None,
+            "face_spoofing": self.spoof_clf is not None,
+            "head_pose": self.headpose_model is not None,
+            "face_recognition": self.face_index is not None,
+        }
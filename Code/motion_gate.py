@@ -0,0 +1,100 @@
+from collections import OrderedDict
+
+import cv2
+
+from frame_context import FrameContext
+
+# Size of the grayscale thumbnail compared between frames
+SIGNATURE_SIZE = (32, 24)
+
+
+def frame_signature(frame):
+    """Return the small grayscale thumbnail used to compare frames, of an image or a FrameContext"""
+    if isinstance(frame, FrameContext):
+        frame = frame.gray
+    elif frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(frame, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def is_static(signature, reference, threshold):
+    """True when a frame barely differs from the reference frame"""
+    return reference is not None and cv2.absdiff(signature, reference).mean() < threshold
+
+
+class MotionGate:
+    """
+    Skips the analysis of frames where nothing moved.
+
+    For each stream the gate keeps the signature and the results of the
+    last fully analysed frame. A new frame whose signature differs from it
+    by less than `threshold` (mean absolute difference, 0-255) reuses those
+    results; the caller still feeds them to the temporal alerts, so the
+    counters keep advancing. Frames are compared with the last analysed
+    frame rather than the previous one, so slow drifts add up, and a full
+    analysis is forced after `max_skips` reused frames.
+
+    Parameters
+    ----------
+    threshold : float, optional
+        Mean thumbnail difference under which a frame is static. The default is 3.
+    max_skips : int, optional
+        Number of consecutive frames that may reuse the same results. The default is 30.
+    max_streams : int, optional
+        Number of streams remembered, the least recently used is forgotten first. The default is 10000.
+    """
+
+    def __init__(self, threshold=3, max_skips=30, max_streams=10000):
+        self.threshold = threshold
+        self.max_skips = max_skips
+        self.max_streams = max_streams
+        self._streams = OrderedDict()
+
+    def reference(self, key):
+        """
+        Return the last fully analysed frame of a stream
+
+        Returns
+        -------
+        reference : tuple or None
+            (signature, results) new frames are compared with, None when the
+            next frame must be analysed anyway.
+        """
+        entry = self._streams.get(key)
+        if entry is None or entry[2] >= self.max_skips:
+            return None
+        return entry[0], entry[1]
+
+    def store(self, key, signature, results):
+        """Remember a fully analysed frame of a stream"""
+        self._streams[key] = [signature, dict(results), 0]
+        self._streams.move_to_end(key)
+        if len(self._streams) > self.max_streams:
+            self._streams.popitem(last=False)
+
+    def skip(self, key):
+        """Count a static frame that reused the results of a stream"""
+        entry = self._streams.get(key)
+        if entry is not None:
+            entry[2] += 1
+            self._streams.move_to_end(key)
+
+    def check(self, key, signature):
+        """
+        Gate a frame in one step, for callers analysing frames themselves
+
+        Returns
+        -------
+        results : dict or None
+            Copy of the results to reuse when the frame is static, None when
+            it must be analysed.
+        """
+        reference = self.reference(key)
+        if reference is None or not is_static(signature, reference[0], self.threshold):
+            return None
+        self.skip(key)
+        return dict(reference[1])
+
+    def discard(self, key):
+        """Forget a stream"""
+        self._streams.pop(key, None)
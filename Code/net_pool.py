@@ -0,0 +1,65 @@
+import queue
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+
+def read_buffers(*paths):
+    """Read model files into memory once, for building several nets from them"""
+    return [np.fromfile(path, np.uint8) for path in paths]
+
+
+class NetPool:
+    """
+    Independently loaded instances of a model, checked out per inference.
+
+    An OpenCV DNN net keeps its input and intermediate blobs inside the
+    object, so two threads must never run setInput/forward on the same
+    net. The pool holds `size` instances and lends each one to a single
+    caller at a time, so up to `size` threads run the model in parallel
+    within one process and the others wait for a free instance.
+
+    Instances are built by `create`, typically from buffers returned by
+    read_buffers so the model files are read from disk only once.
+
+    Parameters
+    ----------
+    create : callable
+        Returns a new instance of the model.
+    size : int, optional
+        Number of instances. The default is 1.
+    num_threads : int, optional
+        Threads of OpenCV's parallel backend, set with cv2.setNumThreads.
+        The setting is process wide and a forward started while another one
+        holds the threads runs on its own thread only, so this is the
+        budget shared by all instances. The default is None (OpenCV's
+        default, one thread per core).
+    """
+
+    def __init__(self, create, size=1, num_threads=None):
+        if num_threads is not None:
+            cv2.setNumThreads(num_threads)
+        self.instances = [create() for _ in range(size)]
+        # LIFO keeps reusing the most recently used instance, whose buffers
+        # are the most likely to still be in cache
+        self._free = queue.LifoQueue()
+        for instance in self.instances:
+            self._free.put(instance)
+
+    def __len__(self):
+        return len(self.instances)
+
+    @contextmanager
+    def checkout(self):
+        """Borrow an instance for the duration of a with block"""
+        instance = self._free.get()
+        try:
+            yield instance
+        finally:
+            self._free.put(instance)
+
+    def run(self, fn, *args, **kwargs):
+        """Call fn(instance, *args, **kwargs) on a borrowed instance"""
+        with self.checkout() as instance:
+            return fn(instance, *args, **kwargs)
@@ -1,72 +1,310 @@
 import cv2
 import sys
+import time
 import os
 import matplotlib
 import numpy as np
 from collections import Counter
 
+from net_pool import read_buffers
+
 ############################################ Setup YOLO v3 ######################################################
-lbl_file        = 'models/yolov3.txt'
-classes         = open(lbl_file).read().strip().split("\n")
 
-yoloconfig      = 'models/yolov3.cfg'
-yoloweights     = 'models/yolov3.weights'
-net             = cv2.dnn.readNet(yoloweights,yoloconfig)
+def get_yolo_detector(weightsFile=None,configFile=None,labelsFile=None):
+  if weightsFile == None:
+    weightsFile = 'models/yolov3.weights'
+  if configFile == None:
+    configFile = 'models/yolov3.cfg'
+  if labelsFile == None:
+    labelsFile = 'models/yolov3.txt'
+
+  classes = open(labelsFile).read().strip().split("\n")
+  net = cv2.dnn.readNet(weightsFile,configFile)
+  return net,classes
 
 ############################################# YOLO Detection #####################################################
 
-def yoloV3Detect(img,scFactor=1/255,nrMean=(0,0,0),RBSwap=True,scoreThres=0.7,nmsThres=0.4):
+# Objects a student must not have in view during the exam
+BANNED_OBJECTS = ['laptop', 'cell phone', 'book', 'tv']
 
-  ########################## Create blob #########################
-  blob = cv2.dnn.blobFromImage(image=img, 
-                              scalefactor=scFactor, 
-                              size=(416, 416), 
-                              mean=nrMean, 
-                              swapRB=RBSwap, 
-                              crop=False)
-  
-  ########################## Prediction ############################
-  def getOutputLayers(net): 
-    layers = net.getLayerNames() 
-    outLayers = [layers[i[0] - 1] for i in net.getUnconnectedOutLayers()] 
-    return outLayers
+# Input sizes of the adaptive mode, YOLOv3 takes multiples of 32
+INPUT_SIZES = (224, 320, 416, 608)
+
+# A larger input is restored once its expected forward time fits in this
+# share of the latency budget
+RESTORE_HEADROOM = 0.8
+
+def getOutputLayers(net): 
+  layers = net.getLayerNames() 
+  # getUnconnectedOutLayers returns (N,1) before OpenCV 4.5.4 and (N,) since
+  outLayers = [layers[i - 1] for i in np.array(net.getUnconnectedOutLayers()).reshape(-1)] 
+  return outLayers
+
+############################################# Backends #####################################################
+
+# A backend runs the forward pass of a YOLO model on a (N, 3, size, size)
+# blob and returns its output scales, each (N, rows, 5 + classes) or
+# (rows, 5 + classes) for one image, as Darknet's region layers lay them out:
+# normalized center x/y, width, height, objectness, then class scores.
+# `inputSize` is the only size the model accepts, None when any multiple
+# of 32 works.
+
+BACKENDS = ('opencv', 'openvino', 'onnxruntime')
+
+class OpenCVBackend:
+  """
+  Darknet model run with OpenCV's DNN module.
+
+  Parameters
+  ----------
+  net : dnn_Net
+      Net read with cv2.dnn.readNetFromDarknet.
+  openvino : bool, optional
+      Run on OpenVINO's CPU plugin (OpenCV built with the Inference Engine) instead of OpenCV's own CPU kernels. The default is False.
+  """
+
+  def __init__(self,net,openvino=False):
+    if openvino:
+      net.setPreferableBackend(cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE)
+      net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+    self.net = net
+    self.outLayers = getOutputLayers(net)
+    self.inputSize = None
+
+  def forward(self,blob):
+    self.net.setInput(blob)
+    return self.net.forward(self.outLayers)
+
+class OnnxRuntimeBackend:
+  """
+  ONNX export of a YOLO model run with onnxruntime on the CPU.
+
+  The export must end with the decoded region outputs described above
+  (like the Darknet layers OpenCV runs), not with the raw convolutions.
+
+  Parameters
+  ----------
+  model : string or bytes
+      Path to the .onnx file, or its content.
+  numThreads : int, optional
+      Intra-op threads of the session. The default is None (one per core).
+  """
+
+  def __init__(self,model,numThreads=None):
+    # onnxruntime is only needed by deployments choosing this backend
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    if numThreads is not None:
+      options.intra_op_num_threads = numThreads
+    self.session = onnxruntime.InferenceSession(model, options, providers=['CPUExecutionProvider'])
+    modelInput = self.session.get_inputs()[0]
+    self.inputName = modelInput.name
+    # symbolic (dynamic) dimensions are strings
+    size = modelInput.shape[2]
+    self.inputSize = size if isinstance(size, int) else None
+
+  def forward(self,blob):
+    return self.session.run(None, {self.inputName: blob})
+
+def get_backend_factory(backend='opencv',model='yolov3',modelsDir='models'):
+  """
+  Return a function creating new instances of a detector backend
+
+  The model files are read once here, every instance is built from the
+  same buffers.
+
+  Parameters
+  ----------
+  backend : string, optional
+      One of BACKENDS. The default is 'opencv'.
+  model : string, optional
+      Model name, the files are <model>.weights and <model>.cfg (Darknet)
+      or <model>.onnx (onnxruntime) in modelsDir. The default is 'yolov3'.
+  modelsDir : string, optional
+      Directory holding the model files. The default is 'models'.
+
+  Returns
+  -------
+  create : callable
+  """
+  path = os.path.join(modelsDir, model)
+  if backend in ('opencv', 'openvino'):
+    weights, config = read_buffers(path + '.weights', path + '.cfg')
+    return lambda: OpenCVBackend(cv2.dnn.readNetFromDarknet(config, weights), openvino=backend == 'openvino')
+  if backend == 'onnxruntime':
+    content = open(path + '.onnx', 'rb').read()
+    return lambda: OnnxRuntimeBackend(content)
+  raise ValueError(f"Unknown detector backend: {backend}, expected one of {BACKENDS}")
 
-  net.setInput(blob) 
-  outLyrs = getOutputLayers(net) 
-  preds = net.forward(outLyrs)
+class YoloDetector:
+  """
+  YOLOv3 detector bound to one backend instance.
+
+  The output layer names, the class names and the banned objects are
+  resolved once, when the detector is created, instead of on
+  every frame. A backend cannot run two forwards at once, so parallel
+  workers each create their own detector.
+
+  With a latency budget the input size adapts to the load of the host:
+  after each forward the detector updates its moving average of the
+  forward time and steps down to the next smaller size of `inputSizes`
+  while it exceeds the budget, or back up when the larger size is expected
+  to fit in it again (forward time scales with the input area). Models
+  with a fixed input size always run at that size.
+
+  Parameters
+  ----------
+  backend : OpenCVBackend, OnnxRuntimeBackend or dnn_Net
+      Backend running the model, a Darknet net as returned by get_yolo_detector is run with OpenCVBackend.
+  classes : list of string
+      Class names of the net outputs.
+  bannedObjects : list of string, optional
+      Class names reported as banned objects. The default is BANNED_OBJECTS.
+  scoreThres : float, optional
+      Minimum class confidence of a detection. The default is 0.7.
+  nmsThres : float, optional
+      Overlap threshold of the non-maximal suppression. The default is 0.4.
+  inputSize : int, optional
+      Side of the square input blob, the starting size in adaptive mode. The default is 416.
+  latencyBudget : float, optional
+      Target forward time in seconds, None keeps the input size fixed. The default is None.
+  inputSizes : tuple of int, optional
+      Sizes the adaptive mode chooses from. The default is INPUT_SIZES.
+  smoothing : float, optional
+      Weight of the latest forward in the moving average. The default is 0.2.
+  """
+
+  def __init__(self,backend,classes,bannedObjects=BANNED_OBJECTS,scFactor=1/255,nrMean=(0,0,0),RBSwap=True,scoreThres=0.7,nmsThres=0.4,
+               inputSize=416,latencyBudget=None,inputSizes=INPUT_SIZES,smoothing=0.2):
+    if isinstance(backend, cv2.dnn.Net):
+      backend = OpenCVBackend(backend)
+    self.backend = backend
+    self.classes = classes
+    for name in bannedObjects:
+      if name not in classes:
+        raise ValueError(f"Unknown banned object class: {name}")
+    self.bannedObjects = list(bannedObjects)
+    self.scFactor = scFactor
+    self.nrMean = nrMean
+    self.RBSwap = RBSwap
+    self.scoreThres = scoreThres
+    self.nmsThres = nmsThres
+    self.inputSizes = sorted(inputSizes)
+    if backend.inputSize is not None:
+      inputSize, latencyBudget = backend.inputSize, None
+    if latencyBudget is not None and inputSize not in self.inputSizes:
+      raise ValueError(f"Input size {inputSize} is not one of {self.inputSizes}")
+    self.inputSize = inputSize
+    self.latencyBudget = latencyBudget
+    self.smoothing = smoothing
+    # moving average of the forward time at the current input size
+    self.forwardTime = None
+    # input size of the latest forward
+    self.lastInputSize = None
+    # sizes already run once, the first forward at a size allocates buffers
+    self._warmSizes = set()
+
+  @classmethod
+  def load(cls,weightsFile=None,configFile=None,labelsFile=None,**kwargs):
+    """Read the net and class names with get_yolo_detector and wrap them in a detector"""
+    net,classes = get_yolo_detector(weightsFile,configFile,labelsFile)
+    return cls(net,classes,**kwargs)
+
+  def detect(self,img):
+    """
+    Detect objects in an image
+
+    Returns
+    -------
+    detections : list
+        [boxes, class names] of the objects kept after NMS, boxes are [x, y, w, h].
+    """
+    return self.detect_batch([img])[0]
+
+  def detect_batch(self,imgs):
+    """Detect objects in several images with a single forward pass"""
+    size = self.inputSize
+
+    ########################## Create one blob for all images #########################
+    blob = cv2.dnn.blobFromImages(images=imgs, 
+                                 scalefactor=self.scFactor, 
+                                 size=(size, size), 
+                                 mean=self.nrMean, 
+                                 swapRB=self.RBSwap, 
+                                 crop=False)
+    
+    ########################## Prediction ############################
+    start = time.perf_counter()
+    preds = self.backend.forward(blob)
+    self.lastInputSize = size
+    self._adapt(size, time.perf_counter() - start)
+
+    # Each output is (rows, 85) for a single image and (N, rows, 85) for a batch
+    preds = [scale.reshape(len(imgs), -1, scale.shape[-1]) for scale in preds]
+
+    return [extractDetections([scale[n] for scale in preds],imgs[n].shape,self.classes,self.scoreThres,self.nmsThres)
+            for n in range(len(imgs))]
+
+  def _adapt(self,size,seconds):
+    """Fold a forward time into the average and pick the next input size"""
+    if self.latencyBudget is None:
+      return
+    if size not in self._warmSizes:
+      self._warmSizes.add(size)
+      return
+    if self.forwardTime is None:
+      self.forwardTime = seconds
+    else:
+      self.forwardTime += self.smoothing*(seconds - self.forwardTime)
+
+    i = self.inputSizes.index(size)
+    if self.forwardTime > self.latencyBudget and i > 0:
+      self._setInputSize(self.inputSizes[i - 1])
+    elif i < len(self.inputSizes) - 1:
+      larger = self.inputSizes[i + 1]
+      if self.forwardTime*(larger/size)**2 < RESTORE_HEADROOM*self.latencyBudget:
+        self._setInputSize(larger)
+
+  def _setInputSize(self,size):
+    # expected forward time at the new size, until it is measured
+    self.forwardTime *= (size/self.inputSize)**2
+    self.inputSize = size
+
+  def summarize(self,fclasses):
+    """Return the number of people and the banned objects among detected class names"""
+    counts = Counter(fclasses)
+    banned = [name for name in self.bannedObjects if counts[name] >= 1]
+    return counts['person'],banned
+
+def extractDetections(preds,imgShape,classes,scoreThres,nmsThres):
 
   ############### Extract information from the output ###############
-  imgHeight = img.shape[0]
-  imgWidth = img.shape[1]
-
-  classId = [] 
-  confidences = [] 
-  boxes = []
-
-  for scale in preds: 
-    for pred in scale: 
-      scores = pred[5:] 
-      clss = np.argmax(scores) 
-      confidence = scores[clss]
-
-      if confidence > scoreThres: 
-        xc = int(pred[0]*imgWidth) 
-        yc = int(pred[1]*imgHeight) 
-        w = int(pred[2]*imgWidth) 
-        h = int(pred[3]*imgHeight) 
-        x = xc - w/2
-        y = yc - h/2
-        
-        classId.append(clss) 
-        confidences.append(float(confidence)) 
-        boxes.append([x, y, w, h])
+  imgHeight = imgShape[0]
+  imgWidth = imgShape[1]
+
+  # Rows of every output scale in one (rows, 5 + classes) array
+  preds = np.concatenate([scale.reshape(-1, scale.shape[-1]) for scale in preds])
+  scores = preds[:, 5:]
+  classId = scores.argmax(axis=1)
+  confidences = scores[np.arange(len(scores)), classId]
+
+  keep = confidences > scoreThres
+  preds, classId, confidences = preds[keep], classId[keep], confidences[keep]
+
+  # center/size relative to the image -> top left corner and size in pixels,
+  # truncated like int() on each value
+  xc, yc, w, h = np.trunc(preds[:, :4] * np.array([imgWidth, imgHeight, imgWidth, imgHeight])).T
+  boxes = np.stack([xc - w/2, yc - h/2, w, h], axis=1)
   
   ############### Non-maximal suppresion (NMS) #####################
-  selected = cv2.dnn.NMSBoxes(bboxes=boxes, 
-                              scores=confidences, 
+  selected = cv2.dnn.NMSBoxes(bboxes=boxes.tolist(), 
+                              scores=confidences.tolist(), 
                               score_threshold=scoreThres, 
                               nms_threshold=nmsThres)
   
-  fboxes = [boxes[j] for j in selected[:,0]]
-  fclasses = [str(classes[classId[j]]) for j in selected[:,0]] 
-  return [fboxes,fclasses]
\ No newline at end of file
+  # NMSBoxes returns an empty tuple when nothing survives, (N,1) or (N,) otherwise
+  selected = np.array(selected, dtype=int).reshape(-1)
+
+  fboxes = boxes[selected].tolist()
+  fclasses = [str(classes[j]) for j in classId[selected]] 
+  return [fboxes,fclasses]
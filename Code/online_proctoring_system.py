@@ -9,35 +9,48 @@ import face_recognition
 import dlib
 from math import hypot
 
-from object_detection import yoloV3Detect
+from object_detection import YoloDetector
+from tracking import DetectionTracker
 from landmark_models import *
 from face_spoofing import *
 from headpose_estimation import *
-from face_detection import get_face_detector, find_faces
+from face_detection import get_face_detector, face_detector_files, find_faces, find_faces_in_roi, person_roi
+from alert_engine import AlertEngine
+from motion_gate import MotionGate, frame_signature
+from frame_context import FrameContext
+from embedding_store import EmbeddingStore
 
 ################################################ Setup  ######################################################
 
-# face recognition
-l = os.listdir('student_db')
-known_face_encodings = []
-known_face_names = []
+# face recognition: only photos added or changed since the last run are encoded
+store = EmbeddingStore('embeddings')
+store.sync('student_db')
 face_locations = []
 face_encodings = []
 face_names = []
 
-for image in l:
-    obama_image = face_recognition.load_image_file('student_db/'+image)
-    obama_face_encoding = face_recognition.face_encodings(obama_image)[0]
-
-    known_face_encodings.append(obama_face_encoding)
-    known_face_names.append(image.split('.')[0])
+# one float32 matrix searched with a single matmul per face
+face_index = store.index()
 
 
 # headpose model
 h_model = load_hp_model('models/Headpose_customARC_ZoomShiftNoise.hdf5')
 
-# face detection model
-face_model = get_face_detector()
+# face detection model, FACE_DETECTOR=caffe selects the res10 Caffe model
+modelFile, configFile, quantized = face_detector_files(os.environ.get("FACE_DETECTOR", "quantized"))
+face_model = get_face_detector(modelFile, configFile, quantized)
+# FACE_SEARCH=person looks for the face in the upper part of the person box
+# only, resized to FACE_INPUT_SIZE instead of the whole frame
+face_search = os.environ.get("FACE_SEARCH", "frame")
+face_input_size = int(os.environ.get("FACE_INPUT_SIZE", "300"))
+
+# object detection model
+yolo = YoloDetector.load()
+# full detection every 10 processed frames or on a scene change, boxes tracked in between
+tracker = DetectionTracker(yolo, detect_every=10)
+
+# face spoofing model
+spoof_clf = get_spoof_classifier()
 
 # face landmark model
 predictor = dlib.shape_predictor("models/shape_predictor_68_face_landmarks.dat")
@@ -45,25 +58,25 @@ predictor = dlib.shape_predictor("models/shape_predictor_68_face_landmarks.dat")
 # Others
 video_capture = cv2.VideoCapture(0)
 process_this_frame = False
-no_of_frames_0 = 0
-no_of_frames_1 = 0
-no_of_frames_2 = 0
-no_of_frames_3 = 0
-no_of_frames_4 = 0
-no_of_frames_5 = 0
-no_of_frames_6 = 0
-no_of_frames_7 = 0
 font = cv2.FONT_HERSHEY_PLAIN
 flag = True
 
 #################################################### ALERT #####################################################
-def alert(condition,no_of_frames):
-    if(condition):
-        no_of_frames=no_of_frames+1
-    else:
-        no_of_frames=0
+# each check alerts once its condition held on more than 10 consecutive processed frames
+alerts = AlertEngine(['multiple_person', 'banned_objects', 'face_recognition', 'eye_tracking',
+                      'mouth_open', 'head_pose', 'face_spoofing', 'no_face'], threshold=10)
+session = 'webcam'
+
+# conditions of the frame being analysed, reused while the scene stays static
+frame_conditions = {}
+
+def check(name, condition):
+    frame_conditions[name] = condition
+    return alerts.update(session, name, condition)
 
-    return no_of_frames
+# frames that barely differ from the last analysed one reuse its conditions
+gate = MotionGate(threshold=3, max_skips=30)
+last_report = None
 
 #################################################### MAIN #####################################################
 
@@ -74,19 +87,37 @@ while True:
     # Grab a single frame of video
     ret, frame = video_capture.read()
 
-    frame2 = frame.copy()
+    # conversions of the frame shared by all the stages below
+    context = FrameContext(frame)
     frame3 = frame.copy()
     report = np.zeros((frame3.shape[0],frame3.shape[1], 3), np.uint8)
   
     # Resize frame of video to 1/4 size for faster face recognition processing
-    small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
+    small = context.resized(0.25)
+    small_frame = small.image
 
-    # Functionalities
+    # Motion gate
+    static_conditions = None
     if process_this_frame:
+        signature = frame_signature(small)
+        static_conditions = gate.check(session, signature)
+
+    if static_conditions is not None:
+        # static scene: previous conditions hold, only the alert counters advance
+        alerting = alerts.update_many(session, static_conditions)
+        report = last_report.copy()
+        if alerting:
+            cv2.putText(report, "ALERT", (120,190), font, 4, (0, 0, 255), 2)
+        horizontalAppendedImg = np.hstack((frame3,report))
+        cv2.imshow("Proctoring_Window", horizontalAppendedImg)
+
+    # Functionalities
+    elif process_this_frame:
+        frame_conditions.clear()
         try:
             ##### Object Detection #####
             try:
-                fboxes,fclasses=yoloV3Detect(small_frame)
+                fboxes,fclasses=tracker.update(small)
             
                 
                 to_detect=['person','laptop','cell phone','book','tv']
@@ -112,7 +143,7 @@ while True:
 
             # Multiple Person Buffer
             condition = (count_items['person']!=1)
-            no_of_frames_0 = alert(condition,no_of_frames_0)
+            alert_on = check('multiple_person', condition)
 
             y_pos = 20
             alert_pos = (120,190)
@@ -121,7 +152,7 @@ while True:
             cv2.putText(report, "Number of people detected: "+str(count_items['person']), (1, y_pos), font, 1.1, (0, 255, 0), 2)
 
             # Alert
-            if(no_of_frames_0>10):
+            if(alert_on):
                 cv2.putText(report, "Number of people detected: "+str(count_items['person']), (1, y_pos), font, 1.1, (0, 0, 255), 2)
                 cv2.putText(report, "ALERT", alert_pos, font, 4, (0, 0, 255), 2)
             
@@ -131,13 +162,13 @@ while True:
                         count_items['book']>=1 or 
                         count_items['tv']>=1)
          
-            no_of_frames_1 = alert(condition,no_of_frames_1)
+            alert_on = check('banned_objects', condition)
 
             # Display
             cv2.putText(report, "Banned objects detected: "+str(condition), (1, y_pos+20), font, 1.1, (0, 255, 0), 2)
 
             # Alert
-            if(no_of_frames_1>10):
+            if(alert_on):
                 cv2.putText(report, "Banned objects detected: "+str(condition), (1, y_pos+20), font, 1.1, (0, 0, 255), 2)
                 cv2.putText(report, "ALERT", alert_pos, font, 4, (0, 0, 255), 2)
                 
@@ -147,25 +178,31 @@ while True:
                 #### face detection using caffe model of OpenCV's DNN module ####
                 
                 # detect face
-                faces = find_faces(small_frame, face_model)
+                if face_search == "person":
+                    roi = person_roi(temp1[temp2.index('person')], small_frame.shape)
+                    faces = find_faces_in_roi(small_frame, face_model, roi, size=face_input_size)
+                else:
+                    faces = find_faces(small_frame, face_model, size=face_input_size)
                 if len(faces) >0:
-                    face = faces[0]
+                    face = faces[0, :4].astype(int)
                 else:
                     condition = (len(faces) < 1)
-                    no_of_frames_7 = alert(condition,no_of_frames_7)
+                    alert_on = check('no_face', condition)
                     y_pos = 60
                     alert_pos = (120,190)
 
                     # Display
                     cv2.putText(report, "Number of face detected: "+str(len(faces)), (1, y_pos), font, 1.1, (0, 255, 0), 2)
                     # Alert
-                    if(no_of_frames_7>10):
+                    if(alert_on):
                         cv2.putText(report, "Number of face detected: "+str(len(faces)), (1, y_pos), font, 1.1, (0, 0, 255), 2)
                         cv2.putText(report, "ALERT", alert_pos, font, 4, (0, 0, 255), 2)        
                     
                     horizontalAppendedImg = np.hstack((frame3,report))
                     
                     cv2.imshow("Proctoring_Window", horizontalAppendedImg)
+                    gate.store(session, signature, frame_conditions)
+                    last_report = report
                     continue
                 
                 # Display Face Detection
@@ -180,32 +217,26 @@ while True:
                     face_locations = [[top, right, bottom, left]]
                    
                     # Convert BGR image to RGB image (which  uses)
-                    rgb_small_frame = small_frame[:, :, ::-1]
+                    rgb_small_frame = small.rgb
 
                     # get CNN feature vector
                     face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
 
                     # get similarity
                     face_encoding = face_encodings[0]
-                    matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-                    face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-                    best_match_index = np.argmin(face_distances)
-                    if matches[best_match_index]:
-                        name = known_face_names[best_match_index]
-                    else:
-                        name = "Unknown"
+                    name, _ = face_index.identify(face_encoding)
                     flag = False
                 
                 # Buffer
                 condition = (name=='Unknown')  
-                no_of_frames_2 = alert(condition,no_of_frames_2)
+                alert_on = check('face_recognition', condition)
 
                 # Display
                 cv2.putText(report, "Face Recognized: "+str(name), (1, y_pos+40), font, 1.1, (0, 255, 0), 2)
 
 
                 # Alert
-                if(no_of_frames_2>10):
+                if(alert_on):
                     cv2.putText(report, "Face Recognized: "+str(name), (1, y_pos+40), font, 1.1, (0, 0, 255), 2)
                     cv2.putText(report, "ALERT", alert_pos, font, 4, (0, 0, 255), 2)
                    
@@ -218,34 +249,32 @@ while True:
                 right = face[2]*4
                 bottom = face[3]*4
                 face_dlib = dlib.rectangle(left, top, right, bottom)
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                facial_landmarks = predictor(gray, face_dlib)
+                facial_landmarks = predictor(context.gray, face_dlib)
 
-                mouth_ratio = get_mouth_ratio([60,62,64,66], frame2,facial_landmarks)
+                mouth_ratio = get_mouth_ratio([60,62,64,66], context,facial_landmarks)
                 
                 # Buffer
                 condition = (mouth_ratio>0.1)
-                no_of_frames_4 = alert(condition,no_of_frames_4)
+                alert_on = check('mouth_open', condition)
 
                 # Display
                 cv2.putText(report, "Mouth Open: "+str(condition), (1, y_pos+80), font, 1.1, (0, 255, 0), 2)
 
                 # Alert
-                if(no_of_frames_4>10):
+                if(alert_on):
                     cv2.putText(report, "Mouth Open: "+str(condition), (1, y_pos+80), font, 1.1, (0, 0, 255), 2)
                     cv2.putText(report, "ALERT", alert_pos, font, 4, (0, 0, 255), 2)
 
                 #### head pose ####
-                oAnglesNp,oBboxExpanded = headpose_inference(h_model, frame2, face)
+                oAnglesNp,oBboxExpanded = headpose_inference(h_model, context, face)
 
                 # Display (head angle)
                 frame3 = displayHeadpose(frame3, oAnglesNp,oOffset = 0)
                 
                 
                 # Buffer
-                condition1=(round(oAnglesNp[0],1) not in [0.0,-1.0,-1.1,-1.2,-1.3,-1.4,-1.5,-1.6,-1.7] and 
-                            round(oAnglesNp[1],0) not in [0.0,1.0,2.0,3.0,4.0,5.0])
-                no_of_frames_5 = alert(condition1,no_of_frames_5)
+                condition1=is_looking_away(oAnglesNp)
+                alert_on = check('head_pose', condition1)
 
 
                 # Display
@@ -255,22 +284,22 @@ while True:
                     cv2.putText(report, "Head Pose: Looking at screen", (1, y_pos+100), font, 1.1, (0, 255, 0), 2)
 
                 # Alert
-                if(no_of_frames_5>10):
+                if(alert_on):
                     cv2.putText(report, "Head Pose: Looking away from screen", (1, y_pos+100), font, 1.1, (0, 0, 255), 2)
                     cv2.putText(report, "ALERT", alert_pos, font, 4, (0, 0, 255), 2)
             
 
                 ##### Blinking (to support down eye tracking) ######
 
-                left_eye_ratio = get_blinking_ratio([36, 37, 38, 39, 40, 41], frame2,facial_landmarks)
-                right_eye_ratio = get_blinking_ratio([42, 43, 44, 45, 46, 47], frame2,facial_landmarks)
+                left_eye_ratio = get_blinking_ratio([36, 37, 38, 39, 40, 41], context,facial_landmarks)
+                right_eye_ratio = get_blinking_ratio([42, 43, 44, 45, 46, 47], context,facial_landmarks)
                 blinking_ratio = (left_eye_ratio + right_eye_ratio) / 2
                 
                 ##### eye tracker #####
 
-                gaze_ratio1_left_eye, gaze_ratio2_left_eye = get_gaze_ratio([36, 37, 38, 39, 40, 41], frame2,facial_landmarks)
+                gaze_ratio1_left_eye, gaze_ratio2_left_eye = get_gaze_ratio([36, 37, 38, 39, 40, 41], context,facial_landmarks)
 
-                gaze_ratio1_right_eye, gaze_ratio2_right_eye = get_gaze_ratio([42, 43, 44, 45, 46, 47], frame2,facial_landmarks)
+                gaze_ratio1_right_eye, gaze_ratio2_right_eye = get_gaze_ratio([42, 43, 44, 45, 46, 47], context,facial_landmarks)
 
                 # Left/Right
                 new_frame1 = np.zeros((500, 500, 3), np.uint8)
@@ -289,7 +318,7 @@ while True:
 
                 # Buffer
                 condition = (gaze_ratio1 <= 0.35 or gaze_ratio1>=4 or condition1==True)
-                no_of_frames_3 = alert(condition,no_of_frames_3)
+                alert_on = check('eye_tracking', condition)
 
                 # Display
                 if(condition):
@@ -298,23 +327,23 @@ while True:
                     cv2.putText(report, "Eye Tracking: Looking at screen", (1, y_pos+60), font, 1.1, (0, 255, 0), 2)
 
                 # Alert
-                if(no_of_frames_3>10):
+                if(alert_on):
                     cv2.putText(report, "Eye Tracking: Looking away from screen", (1, y_pos+60), font, 1.1, (0, 0, 255), 2)
                     cv2.putText(report, "ALERT", alert_pos, font, 4, (0, 0, 255), 2)
                     
 
                 #### face spoofing ####
-                measures = face_spoof(frame2,face)
+                measures = face_spoof(context,face,spoof_clf)
 
                 # Buffer
                 condition = (np.mean(measures) < 0.7)
-                no_of_frames_6 = alert(condition,no_of_frames_6)
+                alert_on = check('face_spoofing', condition)
 
                 # Display
                 cv2.putText(report, "Spoof Face detected: "+str(condition), (1, y_pos+120), font, 1.1, (0, 255, 0), 2)
                 
                 # Alert
-                if(no_of_frames_6>10):
+                if(alert_on):
                     cv2.putText(report, "Spoof Face detected: "+str(condition), (1, y_pos+120), font, 1.1, (0, 0, 255), 2)
                     cv2.putText(report, "ALERT", alert_pos, font, 4, (0, 0, 255), 2)
             
@@ -325,6 +354,8 @@ while True:
    
             horizontalAppendedImg = np.hstack((frame3,report))
             cv2.imshow("Proctoring_Window", horizontalAppendedImg)
+            gate.store(session, signature, frame_conditions)
+            last_report = report
 
         except Exception as e:
             print(e) 
@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+
+from frame_context import as_context
+
+# Size of the thumbnail compared to detect scene changes
+SIGNATURE_SIZE = (32, 24)
+
+
+class DetectionTracker:
+    """
+    Runs object detection on some frames and tracks its boxes on the others.
+
+    People and objects in front of a webcam barely move between frames, so
+    the detector runs every `detect_every` frames, or earlier when the scene
+    changes. In between, the boxes of the last detection are moved with the
+    sparse optical flow (pyramidal Lucas-Kanade) of corners found inside
+    them, and their classes are kept, so the counts feeding the alerts stay
+    continuous.
+
+    A scene change is measured as the mean absolute difference between a
+    small grayscale thumbnail of the frame and the one of the last detected
+    frame, so slow drifts also trigger a detection once they add up.
+
+    Parameters
+    ----------
+    detector : YoloDetector
+        Detector run on the key frames.
+    detect_every : int, optional
+        Maximum number of frames between two detections. The default is 10.
+    scene_change : float, optional
+        Mean thumbnail difference (0-255) that triggers a detection. The default is 25.
+    max_corners : int, optional
+        Number of corners tracked over all boxes. The default is 50.
+    """
+
+    def __init__(self, detector, detect_every=10, scene_change=25, max_corners=50):
+        self.detector = detector
+        self.detect_every = detect_every
+        self.scene_change = scene_change
+        self.max_corners = max_corners
+        self.boxes = []
+        self.classes = []
+        # whether the latest update ran the detector
+        self.detected = False
+        self.frames_since_detection = 0
+        self._gray = None
+        self._signature = None
+
+    def update(self, frame):
+        """
+        Return the detections of a new frame, an image or a FrameContext
+
+        Returns
+        -------
+        detections : list
+            [boxes, class names] as returned by the detector, boxes are [x, y, w, h].
+        """
+        context = as_context(frame)
+        gray = context.gray
+        signature = cv2.resize(gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+
+        if self._due(signature):
+            self.boxes, self.classes = self.detector.detect(context.image)
+            self._signature = signature
+            self.frames_since_detection = 0
+            self.detected = True
+        else:
+            self.boxes = self._track(self._gray, gray)
+            self.frames_since_detection += 1
+            self.detected = False
+
+        self._gray = gray
+        return [self.boxes, self.classes]
+
+    def _due(self, signature):
+        if self._gray is None or self.frames_since_detection + 1 >= self.detect_every:
+            return True
+        return cv2.absdiff(signature, self._signature).mean() > self.scene_change
+
+    def _track(self, prev, gray):
+        """Move every box by the median flow of the corners tracked inside it"""
+        if len(self.boxes) == 0:
+            return self.boxes
+        h, w = gray.shape
+        boxes = np.array(self.boxes, dtype=np.float32)
+        x0 = np.clip(boxes[:, 0], 0, w).astype(int)
+        y0 = np.clip(boxes[:, 1], 0, h).astype(int)
+        x1 = np.clip(boxes[:, 0] + boxes[:, 2], 0, w).astype(int)
+        y1 = np.clip(boxes[:, 1] + boxes[:, 3], 0, h).astype(int)
+
+        mask = np.zeros_like(gray)
+        for i in range(len(boxes)):
+            mask[y0[i]:y1[i], x0[i]:x1[i]] = 255
+        points = cv2.goodFeaturesToTrack(prev, self.max_corners, 0.01, 3, mask=mask)
+        if points is None:
+            return self.boxes
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points, None, winSize=(15, 15), maxLevel=2)
+        found = status.reshape(-1) == 1
+        points, flow = points.reshape(-1, 2)[found], (moved - points).reshape(-1, 2)[found]
+
+        for i in range(len(boxes)):
+            inside = ((points[:, 0] >= x0[i]) & (points[:, 0] < x1[i]) &
+                      (points[:, 1] >= y0[i]) & (points[:, 1] < y1[i]))
+            if inside.any():
+                boxes[i, :2] += np.median(flow[inside], axis=0)
+        return boxes.tolist()
@@ -0,0 +1,118 @@
+"""
+Admission control in front of the analysis pool.
+
+The pool works through its calls in arrival order, so under overload every
+new frame waits behind the whole backlog and its results come back too late
+to be useful. AdmissionQueue bounds the number of calls waiting for a
+worker: once it is full new calls are refused with an estimate of when to
+retry, and a new frame of a session replaces the older frame of that
+session still waiting in the queue.
+"""
+
+import asyncio
+import math
+import threading
+
+
+class QueueFullError(Exception):
+    """The analysis queue is full, `retry_after` estimates when to retry in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class FrameSupersededError(Exception):
+    """A queued frame was dropped because a newer frame of its session arrived"""
+
+
+class AdmissionQueue:
+    """
+    Bounded queue of analysis calls.
+
+    At most `workers` + `max_queued` calls are pending (queued or running) at
+    once. A call of a session that still has a call waiting for a worker
+    cancels that call; calls already running are left to finish.
+
+    Parameters
+    ----------
+    workers : int
+        Number of workers of the executor.
+    max_queued : int
+        Number of calls allowed to wait for a worker.
+    smoothing : float, optional
+        Weight of the latest call in the average service time used for the
+        Retry-After estimate. The default is 0.2.
+    """
+
+    def __init__(self, workers, max_queued, smoothing=0.2):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.smoothing = smoothing
+        self.service_time = 0.0
+        self._pending = 0
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def capacity(self):
+        return self.workers + self.max_queued
+
+    def retry_after(self):
+        """Seconds until the queue is expected to have room again"""
+        backlog = self._pending - self.workers + 1
+        return max(1, math.ceil(backlog * self.service_time / self.workers))
+
+    def record(self, seconds):
+        """Fold the time a call spent on a worker into the average service time"""
+        if self.service_time:
+            self.service_time += self.smoothing * (seconds - self.service_time)
+        else:
+            self.service_time = seconds
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, executor, fn, *args, session_id=None):
+        """
+        Run fn(*args) in the executor once admitted
+
+        Raises
+        ------
+        QueueFullError
+            When the queue is full.
+        FrameSupersededError
+            When a newer call of the same session replaced this one before
+            it reached a worker.
+        """
+        if session_id is not None and session_id in self._latest:
+            # the older frame of the session gives its place to this one,
+            # cancelling it releases its slot if it has not started yet
+            self._latest.pop(session_id).cancel()
+
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise QueueFullError(self.retry_after())
+            self._pending += 1
+
+        future = executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        if session_id is not None:
+            self._latest[session_id] = future
+
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # a superseded call is no longer the latest of its session, any
+            # other cancellation comes from the request itself
+            if future.cancelled() and session_id is not None and self._latest.get(session_id) is not future:
+                raise FrameSupersededError(session_id) from None
+            raise
+        finally:
+            if session_id is not None and self._latest.get(session_id) is future:
+                del self._latest[session_id]
@@ -1,40 +1,183 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import threading
+import asyncio
+import time
 import cv2
 import numpy as np
-from collections import Counter
 import os
 import sys
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import base64
+import binascii
+import struct
 from io import BytesIO
 from PIL import Image
 import json
 
 # Import các module từ Code directory
 sys.path.append('Code')
-# from face_detection import get_face_detector, find_faces  # Removed - not needed
+from model_registry import ModelRegistry
+from face_detection import find_faces, find_faces_batch, person_roi
+from face_spoofing import face_spoof
+from headpose_estimation import headpose_crop, headpose_predict, is_looking_away
+from inference_batcher import InferenceBatcher
+from motion_gate import MotionGate, frame_signature, is_static
+from frame_context import FrameContext, as_context
+from alert_engine import AlertEngine
+from sessions import SessionState, ALERT_CHECKS, ALERT_THRESHOLD, session_alerts
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+import metrics
+from admission import AdmissionQueue, QueueFullError, FrameSupersededError
+from embedding_store import EmbeddingStore, IMAGE_EXTENSIONS, student_name, store_version
+
+try:
+    import face_recognition
+except ImportError:
+    # without face_recognition (dlib) faces are detected but not identified
+    face_recognition = None
+
+MODELS_DIR = 'Code/models'
+STUDENT_DB_PATH = 'Code/student_db'
+# Face encodings of the photos in STUDENT_DB_PATH, only new or changed
+# photos are encoded at startup
+EMBEDDINGS_DIR = os.environ.get("EMBEDDINGS_DIR", "Code/embeddings")
+FRAME_SCALE = 0.25
+
+# JPEG uploads are decoded straight to the working resolution with the
+# reduced decode modes, which skip most of the IDCT work. A frame is never
+# reduced below DECODE_TARGET_WIDTH pixels wide.
+DECODE_TARGET_WIDTH = int(os.environ.get("DECODE_TARGET_WIDTH", "160"))
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Raw frames start with an 8 byte header: a FourCC naming the pixel layout
+# followed by the width and height as little-endian uint16
+RAW_FRAME_HEADER = struct.Struct("<4sHH")
+RAW_FRAME_FORMATS = {b"BGR3", b"NV12"}
+MAX_BATCH_FRAMES = int(os.environ.get("MAX_BATCH_FRAMES", "64"))
+
+# Frame analysis runs in a worker pool so OpenCV never blocks the event loop.
+# "thread" workers are enough for OpenCV calls, which release the GIL;
+# "process" workers also isolate the Python parts at the cost of one copy
+# of the models per process.
+ANALYSIS_EXECUTOR = os.environ.get("ANALYSIS_EXECUTOR", "thread")
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "2"))
+# Thread workers share one registry holding ANALYSIS_WORKERS instances of
+# every OpenCV model; OPENCV_THREADS sets the threads of OpenCV's parallel
+# backend shared by all of them (unset: one per core)
+OPENCV_THREADS = int(os.environ["OPENCV_THREADS"]) if os.environ.get("OPENCV_THREADS") else None
+
+# Object detector: backend (opencv, openvino, onnxruntime) and model files
+# (<model>.weights/.cfg, or <model>.onnx for onnxruntime) in MODELS_DIR
+OBJECT_DETECTOR_BACKEND = os.environ.get("OBJECT_DETECTOR_BACKEND", "opencv")
+OBJECT_DETECTOR_MODEL = os.environ.get("OBJECT_DETECTOR_MODEL", "yolov3")
+
+# Face detector variant: "quantized" (uint8 TF model shipped in Code/models)
+# or "caffe" (res10 SSD, model file downloaded separately)
+FACE_DETECTOR = os.environ.get("FACE_DETECTOR", "quantized")
+# FACE_SEARCH=person runs the face detector on the upper part of the box of
+# the only person YOLO found instead of the whole frame ("frame"), resized
+# to a FACE_INPUT_SIZE square
+FACE_SEARCH = os.environ.get("FACE_SEARCH", "frame")
+FACE_INPUT_SIZE = int(os.environ.get("FACE_INPUT_SIZE", "300"))
+
+# analysis calls allowed to wait for a worker before new ones get a 429
+ANALYSIS_QUEUE_SIZE = int(os.environ.get("ANALYSIS_QUEUE_SIZE", "32"))
+
+# With thread workers, the DNN forwards of concurrent requests are grouped
+# into one batched forward per model: a batch runs once BATCH_MAX_SIZE
+# inputs are pending or BATCH_WINDOW_MS after the first one arrived.
+# A window of 0 turns batching off.
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", "5"))
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "16"))
+# batchers only help workers sharing the process, i.e. thread workers
+BATCHING = ANALYSIS_EXECUTOR == "thread" and BATCH_WINDOW_MS > 0
+
+# Forward time budget of YOLO: when set, the input size adapts between
+# 224 and 608 to keep forwards within it. 0 keeps a fixed 416 input.
+DETECTION_LATENCY_BUDGET = float(os.environ.get("DETECTION_LATENCY_BUDGET_MS", "0")) / 1000 or None
+
+# Frames of a session differing from its last analysed frame by less than
+# MOTION_THRESHOLD (mean difference of a 32x24 grayscale thumbnail, 0-255)
+# reuse its results; at most MOTION_MAX_SKIPS frames in a row. 0 disables it.
+MOTION_THRESHOLD = float(os.environ.get("MOTION_THRESHOLD", "3"))
+MOTION_MAX_SKIPS = int(os.environ.get("MOTION_MAX_SKIPS", "30"))
+
+# Temporal alert state is forgotten after SESSION_TTL idle seconds and at
+# most MAX_SESSIONS sessions are tracked at once
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "300"))
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", "10000"))
 
 # Global variables for models
 known_face_names = []
-face_model = None
+models = None
+
+# Store of the student face encodings, updated by the enrollment endpoints
+# one at a time; analyses keep searching the index they started with
+student_store = None
+enrollment_lock = threading.Lock()
+
+# Analysis pool and the models owned by the current worker
+executor = None
+admission = AdmissionQueue(ANALYSIS_WORKERS, ANALYSIS_QUEUE_SIZE)
+worker_state = threading.local()
+
+# Batchers running the shared models for every thread worker, by model
+batchers = {}
+
+# State of the exam sessions streaming over WebSocket, by exam id, and the
+# temporal alert counters of every session (WebSocket or HTTP session_id)
+sessions = {}
+alert_engine = AlertEngine(ALERT_CHECKS, threshold=ALERT_THRESHOLD, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS)
+# last analysed frame of every session, for skipping static frames
+motion_gate = MotionGate(MOTION_THRESHOLD, MOTION_MAX_SKIPS, MAX_SESSIONS)
+
+class InvalidImageError(ValueError):
+    """Raised by an analysis worker when an upload cannot be decoded"""
+
+def load_registry(pool_size, batched=False):
+    """Load and warm up a model registry with the configured detectors"""
+    return ModelRegistry(MODELS_DIR,
+                         detection_budget=DETECTION_LATENCY_BUDGET,
+                         pool_size=pool_size,
+                         num_threads=OPENCV_THREADS,
+                         detector_backend=OBJECT_DETECTOR_BACKEND,
+                         detector_model=OBJECT_DETECTOR_MODEL,
+                         face_detector=FACE_DETECTOR,
+                         embeddings_dir=EMBEDDINGS_DIR,
+                         batched=batched).load().warmup()
 
 def initialize_models():
     """Initialize all required models"""
-    global known_face_names, face_model
+    global known_face_names, models, student_store
     
-    # Load face recognition database (simplified - just store names for now)
-    student_db_path = 'Code/student_db'
-    if os.path.exists(student_db_path):
-        for image_file in os.listdir(student_db_path):
-            if image_file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                known_face_names.append(image_file.split('.')[0])
+    # Encode the photos of the student database not encoded yet, the
+    # registries then load the encodings from the store
+    if face_recognition is not None:
+        student_store = EmbeddingStore(EMBEDDINGS_DIR)
+        if os.path.exists(STUDENT_DB_PATH):
+            encoded = student_store.sync(STUDENT_DB_PATH)
+            print(f"Student database: {len(student_store.names)} faces, {encoded} photos encoded")
+        known_face_names = student_store.names
+    elif os.path.exists(STUDENT_DB_PATH):
+        known_face_names = [student_name(image_file) for image_file in sorted(os.listdir(STUDENT_DB_PATH))
+                            if image_file.lower().endswith(IMAGE_EXTENSIONS)]
     
-    # For now, skip face detection model loading to avoid issues
-    face_model = None
-    print("Face detection model disabled for compatibility")
+    # Load every detector once and run it on a blank frame so the first
+    # request does not pay for parsing model files or allocating buffers.
+    # Thread workers share this registry, one model instance each, except
+    # for the DNN models run by the batchers, loaded once.
+    pool_size = ANALYSIS_WORKERS if ANALYSIS_EXECUTOR == "thread" else 1
+    models = load_registry(pool_size, batched=BATCHING)
+    print(f"Models loaded: {models.status()}")
 
 def image_to_base64(image):
     """Convert OpenCV image to base64 string"""
@@ -49,10 +192,59 @@ def base64_to_image(base64_string):
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     return img
 
+def decode_scale(contents):
+    """Pick the reduced decode factor of an upload from its JPEG header"""
+    try:
+        # Only the header is parsed here, the pixels are decoded by OpenCV
+        header = Image.open(BytesIO(contents))
+    except Exception:
+        return 1
+    if header.format != "JPEG":
+        return 1
+    
+    width = header.size[0]
+    scale = 1
+    for reduction in REDUCED_DECODE_FLAGS:
+        # never decode below the working resolution or the target width
+        if reduction * FRAME_SCALE <= 1 and width / reduction >= DECODE_TARGET_WIDTH:
+            scale = reduction
+    return scale
+
+def raw_frame(contents):
+    """Wrap a raw BGR or NV12 frame in an array without copying the pixels"""
+    fourcc, width, height = RAW_FRAME_HEADER.unpack_from(contents)
+    offset = RAW_FRAME_HEADER.size
+    if width <= 0 or height <= 0:
+        return None
+    
+    if fourcc == b"BGR3":
+        if len(contents) - offset != width * height * 3:
+            return None
+        return np.frombuffer(contents, np.uint8, offset=offset).reshape(height, width, 3)
+    
+    # NV12: full resolution Y plane followed by the interleaved half resolution UV plane
+    if len(contents) - offset != width * height * 3 // 2 or width % 2 or height % 2:
+        return None
+    yuv = np.frombuffer(contents, np.uint8, offset=offset).reshape(height * 3 // 2, width)
+    return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_NV12)
+
+def decode_frame(contents, full_resolution=False):
+    """Decode an upload, returns the frame and the factor it was reduced by"""
+    if contents[:4] in RAW_FRAME_FORMATS and len(contents) >= RAW_FRAME_HEADER.size:
+        return raw_frame(contents), 1
+    
+    nparr = np.frombuffer(contents, np.uint8)
+    if nparr.size == 0:
+        return None, 1
+    
+    scale = 1 if full_resolution else decode_scale(contents)
+    frame = cv2.imdecode(nparr, REDUCED_DECODE_FLAGS.get(scale, cv2.IMREAD_COLOR))
+    return frame, scale
+
 def simple_object_detection(frame):
-    """Simple object detection using OpenCV"""
-    # Convert to grayscale
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    """Simple object detection using OpenCV, on an image or a FrameContext"""
+    # Grayscale version of the frame
+    gray = as_context(frame).gray
     
     # Simple edge detection
     edges = cv2.Canny(gray, 50, 150)
@@ -65,9 +257,9 @@ def simple_object_detection(frame):
     
     return len(significant_objects)
 
-def process_frame(frame):
-    """Process a single frame and return analysis results"""
-    results = {
+def empty_results():
+    """Analysis results of a frame before any check has run"""
+    return {
         "people_count": 0,
         "banned_objects": [],
         "face_detected": False,
@@ -75,56 +267,341 @@ def process_frame(frame):
         "person_name": "Unknown",
         "headpose_alert": False,
         "spoofing_alert": False,
+        "face_box": None,
+        "detection_input_size": None,
+        "static_frame": False,
         "alerts": []
     }
+
+def cascade_faces(face_cascade, gray):
+    """Detect faces in a grayscale image with the Haar cascade, as find_faces does (score 1)"""
+    boxes = np.array(face_cascade.detectMultiScale(gray, 1.1, 4), np.float32).reshape(-1, 4)
+    faces = np.ones((len(boxes), 5), np.float32)
+    faces[:, :2] = boxes[:, :2]
+    faces[:, 2:4] = boxes[:, :2] + boxes[:, 2:]
+    return faces
+
+def identify_face(results, small, face, face_index, timings):
+    """Name the student whose face is at `face` ([left, top, right, bottom] in the small frame)"""
+    stage_start = time.perf_counter()
+    try:
+        left, top, right, bottom = (int(v) for v in face)
+        encodings = face_recognition.face_encodings(small.rgb, [(top, right, bottom, left)])
+        name, _ = face_index.identify(encodings[0])
+        results["person_name"] = name
+        results["face_verified"] = name != "Unknown"
+    except Exception as e:
+        print(f"Face recognition error: {e}")
+    timings["face_recognition"] = timings.get("face_recognition", 0) + time.perf_counter() - stage_start
+
+def process_frames(frames, models, scales=None, timings=None):
+    """Process a batch of frames and return analysis results for each one
+
+    YOLO and the SSD face detector run once on a blob holding every frame
+    of the batch instead of once per frame. `frames` are images or their
+    FrameContext, whose conversions are shared by the stages. `scales`
+    gives the factor each frame was already reduced by when it was decoded.
+    The time spent in each stage is added to the `timings` dict when one
+    is given.
+    """
+    frames = [as_context(frame) for frame in frames]
+    batch_results = [empty_results() for _ in frames]
+    if scales is None:
+        scales = [1] * len(frames)
+    if timings is None:
+        timings = {}
     
     try:
-        # Resize frame for processing
-        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
+        # Resize frames for processing, frames decoded at the working
+        # resolution are used as they are
+        stage_start = time.perf_counter()
+        smalls = [frame.resized(FRAME_SCALE * scale) for frame, scale in zip(frames, scales)]
+        small_frames = [small.image for small in smalls]
+        timings["resize"] = time.perf_counter() - stage_start
         
-        # Simple Object Detection
+        # Object Detection (YOLO when loaded, contour counting otherwise)
+        stage_start = time.perf_counter()
+        person_boxes = [[] for _ in frames]
         try:
-            object_count = simple_object_detection(small_frame)
-            results["people_count"] = object_count
-            
-            if results["people_count"] != 1:
-                results["alerts"].append("Multiple objects detected")
+            if models.yolo is not None:
+                detections = run_model("object_detection", small_frames,
+                                       lambda imgs: models.yolo.run(detect_objects, imgs))
+                for i, (summary, input_size, boxes) in enumerate(detections):
+                    results = batch_results[i]
+                    results["people_count"], results["banned_objects"] = summary
+                    results["detection_input_size"] = input_size
+                    person_boxes[i] = boxes
+
+                    if results["people_count"] != 1:
+                        results["alerts"].append("Multiple people detected")
+                    if results["banned_objects"]:
+                        results["alerts"].append("Banned objects detected")
+            else:
+                for results, small in zip(batch_results, smalls):
+                    object_count = simple_object_detection(small)
+                    results["people_count"] = object_count
+                    
+                    if results["people_count"] != 1:
+                        results["alerts"].append("Multiple objects detected")
                 
         except Exception as e:
             print(f"Object detection error: {e}")
-            results["alerts"].append("Object detection failed")
+            for results in batch_results:
+                results["alerts"].append("Object detection failed")
+        timings["object_detection"] = time.perf_counter() - stage_start
         
-        # Simple face detection using OpenCV's built-in cascade
-        if results["people_count"] >= 1:
+        # Face detection (SSD when loaded, OpenCV's built-in cascade otherwise)
+        # only on the frames where somebody was found
+        with_people = [i for i, results in enumerate(batch_results) if results["people_count"] >= 1]
+        if with_people:
+            stage_start = time.perf_counter()
             try:
-                # Use OpenCV's built-in face cascade
-                face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-                gray = cv2.cvtColor(small_frame, cv2.COLOR_BGR2GRAY)
-                faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-                
+                rois = [face_search_roi(small_frames[i], person_boxes[i]) for i in with_people]
+                if models.face_model is not None:
+                    crops = [smalls[i].crop(roi) for i, roi in zip(with_people, rois)]
+                    faces_per_frame = run_model("face_detection", crops, lambda imgs: detect_faces(models, imgs))
+                else:
+                    with models.face_cascade.checkout() as face_cascade:
+                        faces_per_frame = [cascade_faces(face_cascade, smalls[i].gray[y:y1, x:x1])
+                                           for i, (x, y, x1, y1) in zip(with_people, rois)]
+                # face boxes in the coordinates of the small frame
+                for faces, (x, y, _, _) in zip(faces_per_frame, rois):
+                    faces[:, :4] += np.array([x, y, x, y], np.float32)
+            except Exception as e:
+                print(f"Face detection error: {e}")
+                for i in with_people:
+                    batch_results[i]["alerts"].append("Face detection failed")
+                with_people, faces_per_frame = [], []
+            timings["face_detection"] = time.perf_counter() - stage_start
+
+            headpose_crops = []
+            for i, faces in zip(with_people, faces_per_frame):
+                results = batch_results[i]
                 if len(faces) > 0:
+                    face = faces[0, :4].astype(int)
                     results["face_detected"] = True
                     results["person_name"] = "Face Detected"
                     results["face_verified"] = True
+                    if models.face_index is not None and len(models.face_index) > 0:
+                        identify_face(results, smalls[i], face, models.face_index, timings)
+                    # face box in the coordinates of the uploaded frame
+                    results["face_box"] = [int(v / FRAME_SCALE) for v in face]
                 else:
                     results["alerts"].append("No face detected")
-                    
-            except Exception as e:
-                print(f"Face detection error: {e}")
-                results["alerts"].append("Face detection failed")
+                    continue
+
+                # Face spoofing on the full resolution face region
+                if models.spoof_clf is not None and scales[i] == 1:
+                    stage_start = time.perf_counter()
+                    try:
+                        measures = face_spoof(frames[i], face, models.spoof_clf)
+                        if np.mean(measures) < 0.7:
+                            results["spoofing_alert"] = True
+                            results["alerts"].append("Spoof face detected")
+                    except Exception as e:
+                        print(f"Face spoofing error: {e}")
+                    timings["face_spoofing"] = timings.get("face_spoofing", 0) + time.perf_counter() - stage_start
+
+                # Head pose crop from the decoded frame, predicted for all faces at once
+                if models.headpose_model is not None:
+                    crop, _ = headpose_crop(frames[i], face, 1 / (FRAME_SCALE * scales[i]))
+                    headpose_crops.append((i, crop))
+
+            if headpose_crops:
+                stage_start = time.perf_counter()
+                try:
+                    angles = run_model("head_pose", [crop for _, crop in headpose_crops],
+                                       lambda crops: list(headpose_predict(models.headpose_model, crops)))
+                    for (i, _), frame_angles in zip(headpose_crops, angles):
+                        if is_looking_away(frame_angles):
+                            batch_results[i]["headpose_alert"] = True
+                            batch_results[i]["alerts"].append("Looking away from screen")
+                except Exception as e:
+                    print(f"Head pose error: {e}")
+                timings["head_pose"] = time.perf_counter() - stage_start
                 
     except Exception as e:
         print(f"Frame processing error: {e}")
-        results["alerts"].append("Frame processing failed")
+        for results in batch_results:
+            results["alerts"].append("Frame processing failed")
+    
+    return batch_results
+
+def process_frame(frame, models):
+    """Process a single frame and return analysis results"""
+    return process_frames([frame], models)[0]
+
+def detect_objects(yolo, imgs):
+    """People count and banned objects of each image, with the YOLO input size used and the person boxes"""
+    detections = yolo.detect_batch(imgs)
+    return [(yolo.summarize(fclasses), yolo.lastInputSize,
+             [box for box, name in zip(fboxes, fclasses) if name == "person"])
+            for fboxes, fclasses in detections]
+
+def face_search_roi(small_frame, boxes):
+    """Region of a frame searched for faces: the head of its only person in FACE_SEARCH=person mode"""
+    if FACE_SEARCH == "person" and len(boxes) == 1:
+        return person_roi(boxes[0], small_frame.shape)
+    h, w = small_frame.shape[:2]
+    return 0, 0, w, h
+
+def detect_faces(models, imgs):
+    """Run the face detector on images, in one forward when the model accepts batches"""
+    if models.face_batches:
+        return models.face_model.run(lambda net: find_faces_batch(imgs, net, size=FACE_INPUT_SIZE))
+    return models.face_model.run(lambda net: [find_faces(img, net, size=FACE_INPUT_SIZE) for img in imgs])
+
+def run_model(name, items, run_batch):
+    """Run a model on a list of inputs
+
+    With a batcher running for the model, the inputs join the next batched
+    forward of the shared model; otherwise run_batch runs them directly on
+    the worker's own model.
+    """
+    batcher = batchers.get(name)
+    if batcher is not None:
+        return batcher.submit(items)
+    return run_batch(items)
+
+def start_batchers():
+    """Start one batcher per loaded DNN model of the shared registry"""
+    run_batch = {
+        "object_detection": lambda imgs: models.yolo.run(detect_objects, imgs),
+        "face_detection": lambda imgs: detect_faces(models, imgs),
+        "head_pose": lambda crops: list(headpose_predict(models.headpose_model, crops)),
+    }
+    loaded = models.status()
+    # a model frozen with a batch size of 1 is run by the analysis threads
+    loaded["face_detection"] = loaded["face_detection"] and models.face_batches
+    for name, fn in run_batch.items():
+        if loaded[name]:
+            batchers[name] = InferenceBatcher(fn, max_batch=BATCH_MAX_SIZE, window=BATCH_WINDOW_MS / 1000,
+                                              name=f"batch-{name}",
+                                              on_batch=metrics.INFERENCE_BATCH_SIZE.labels(name).observe)
+
+def init_worker():
+    """Give each analysis worker its models"""
+    if ANALYSIS_EXECUTOR == "thread":
+        # the shared registry holds one instance of each net per thread
+        worker_state.models = models
+    else:
+        worker_state.models = load_registry(1)
+
+def worker_ready():
+    """No-op task used to start every worker at startup"""
+    return worker_state.models.status()
+
+def analyze_images(images, submitted, reference=None):
+    """Decode encoded images and analyse them with the worker's models
+
+    Returns the results of every image, the time spent in each stage and
+    the motion signature of a single image. `submitted` is the
+    time.monotonic() at which the call was queued, the clock is shared by
+    all processes of the host. When a single image barely differs from the
+    `reference` signature it is not analysed and the results are None.
+    """
+    timings = {"queue_wait": time.monotonic() - submitted}
+    models = worker_state.models
+    if ANALYSIS_EXECUTOR == "process":
+        # pick up the students enrolled through the API process
+        models.refresh_face_index()
+    # The spoof classifier is the only stage working on the full resolution frame
+    full_resolution = models.spoof_clf is not None
+    
+    stage_start = time.perf_counter()
+    frames, scales = [], []
+    for index, contents in enumerate(images):
+        frame, scale = decode_frame(contents, full_resolution)
+        
+        if frame is None:
+            raise InvalidImageError(index)
+        frames.append(frame)
+        scales.append(scale)
+    timings["decode"] = time.perf_counter() - stage_start
+    
+    # the thumbnail of the motion gate is made from the small frame analysed next
+    frames = [FrameContext(frame) for frame in frames]
+    signature = frame_signature(frames[0].resized(FRAME_SCALE * scales[0])) if len(frames) == 1 else None
+    if reference is not None and is_static(signature, reference, MOTION_THRESHOLD):
+        return None, timings, signature
+    
+    return process_frames(frames, models, scales, timings), timings, signature
+
+def start_analysis_pool():
+    """Create the configured analysis pool"""
+    if ANALYSIS_EXECUTOR == "process":
+        # spawn rather than fork: a forked child inherits OpenCV's thread
+        # pool in an undefined state
+        return ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=init_worker)
+    if ANALYSIS_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS,
+                                  thread_name_prefix="analysis",
+                                  initializer=init_worker)
+    raise ValueError(f"Unknown ANALYSIS_EXECUTOR: {ANALYSIS_EXECUTOR}")
+
+async def run_analysis(images, session_id=None):
+    """Analyse encoded images in the pool without blocking the event loop
+
+    Calls go through the admission queue: QueueFullError is raised when it
+    is full, FrameSupersededError when a newer frame of `session_id` took
+    the place of this one before it started. A single frame of a session
+    that did not move since its last analysed frame gets that frame's
+    results back, flagged as static_frame.
+    """
+    submitted = time.monotonic()
+    gated = session_id is not None and len(images) == 1 and MOTION_THRESHOLD > 0
+    reference = motion_gate.reference(session_id) if gated else None
+    
+    with metrics.IN_FLIGHT.track_inprogress():
+        try:
+            results, timings, signature = await admission.run(
+                executor, analyze_images, images, submitted, reference and reference[0], session_id=session_id)
+        except InvalidImageError:
+            metrics.FRAMES_DROPPED.labels("invalid").inc(len(images))
+            raise
+        except QueueFullError:
+            metrics.FRAMES_DROPPED.labels("queue_full").inc(len(images))
+            raise
+        except FrameSupersededError:
+            metrics.FRAMES_DROPPED.labels("superseded").inc(len(images))
+            raise
+    
+    elapsed = time.monotonic() - submitted
+    admission.record(elapsed - timings["queue_wait"])
+    metrics.ANALYSIS_LATENCY.observe(elapsed)
+    metrics.observe_timings(timings)
+    
+    if results is None:
+        metrics.FRAMES_STATIC.inc()
+        motion_gate.skip(session_id)
+        return [dict(reference[1], static_frame=True)]
     
+    metrics.FRAMES_PROCESSED.inc(len(results))
+    if gated:
+        motion_gate.store(session_id, signature, results[0])
     return results
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global executor
     # Startup
     initialize_models()
+    if BATCHING:
+        start_batchers()
+    executor = start_analysis_pool()
+    # Submitting one task per worker starts all of them now, so model loading
+    # happens before the first request rather than during it
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[loop.run_in_executor(executor, worker_ready) for _ in range(ANALYSIS_WORKERS)])
+    print(f"Analysis pool ready: {ANALYSIS_WORKERS} {ANALYSIS_EXECUTOR} workers")
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    executor.shutdown(wait=False, cancel_futures=True)
+    for batcher in batchers.values():
+        batcher.close()
+    batchers.clear()
 
 app = FastAPI(
     title="Intelligent Online Exam Proctoring System API",
@@ -142,6 +619,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    """Overloaded: tell the client when to send frames again"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Analysis queue is full"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(FrameSupersededError)
+async def frame_superseded_handler(request: Request, exc: FrameSupersededError):
+    """The frame was dropped for a newer frame of the same session"""
+    return JSONResponse(
+        status_code=409,
+        content={"detail": "Frame superseded by a newer frame of the same session"}
+    )
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -156,53 +650,165 @@ async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "models_loaded": {
-            "face_recognition": len(known_face_names) > 0,
-            "face_detection": face_model is not None
-        }
+        "models_loaded": models.status(),
+        "analysis_pool": {
+            "executor": ANALYSIS_EXECUTOR,
+            "workers": ANALYSIS_WORKERS,
+            "queue_size": ANALYSIS_QUEUE_SIZE,
+            "pending": admission.pending
+        },
+        "active_sessions": len(alert_engine)
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: stage latencies, queue wait, frame counters"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/analyze_frame")
-async def analyze_frame(file: UploadFile = File(...)):
+async def analyze_frame(file: UploadFile = File(...), session_id: Optional[str] = None):
     """Analyze a single frame for proctoring"""
     try:
         # Read image file
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
-        if frame is None:
-            raise HTTPException(status_code=400, detail="Invalid image file")
+        # Decode and process frame in the analysis pool
+        results = (await run_analysis([contents], session_id))[0]
         
-        # Process frame
-        results = process_frame(frame)
+        # Temporal alerts when the frame belongs to a session
+        if session_id is not None:
+            results["session"] = session_alerts(alert_engine, session_id, results)
         
         return JSONResponse(content=results)
         
+    except (QueueFullError, FrameSupersededError):
+        raise
+    except InvalidImageError:
+        raise HTTPException(status_code=400, detail="Invalid image file")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
 @app.post("/analyze_frame_base64")
-async def analyze_frame_base64(data: Dict[str, str]):
+async def analyze_frame_base64(data: Dict[str, str], session_id: Optional[str] = None):
     """Analyze a single frame from base64 encoded image"""
     try:
         if "image" not in data:
             raise HTTPException(status_code=400, detail="Image data not provided")
         
-        # Decode base64 image
-        frame = base64_to_image(data["image"])
-        
-        if frame is None:
-            raise HTTPException(status_code=400, detail="Invalid base64 image")
+        # Decode base64 payload, the image itself is decoded in the pool
+        contents = base64.b64decode(data["image"])
         
         # Process frame
-        results = process_frame(frame)
+        results = (await run_analysis([contents], session_id))[0]
+        
+        # Temporal alerts when the frame belongs to a session
+        if session_id is not None:
+            results["session"] = session_alerts(alert_engine, session_id, results)
+        
+        return JSONResponse(content=results)
+        
+    except (HTTPException, QueueFullError, FrameSupersededError):
+        raise
+    except (InvalidImageError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid base64 image")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+
+@app.post("/analyze_frame_binary")
+async def analyze_frame_binary(request: Request, session_id: Optional[str] = None):
+    """Analyze a single frame sent as the raw request body
+
+    The body is either an encoded image (JPEG, WebP, PNG) or a raw BGR3/NV12
+    frame with its 8 byte header, so clients can skip multipart and base64.
+    """
+    try:
+        contents = await request.body()
+        
+        # Decode and process frame in the analysis pool
+        results = (await run_analysis([contents], session_id))[0]
+        
+        # Temporal alerts when the frame belongs to a session
+        if session_id is not None:
+            results["session"] = session_alerts(alert_engine, session_id, results)
         
         return JSONResponse(content=results)
         
+    except (QueueFullError, FrameSupersededError):
+        raise
+    except InvalidImageError:
+        raise HTTPException(status_code=400, detail="Invalid image data")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
+@app.post("/analyze_frames")
+async def analyze_frames(files: List[UploadFile] = File(...), session_id: Optional[str] = None):
+    """Analyze several frames (e.g. 1-2 seconds of video) in one request"""
+    if len(files) > MAX_BATCH_FRAMES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_FRAMES} frames per request")
+    
+    try:
+        images = [await file.read() for file in files]
+        
+        # Process all frames with one forward pass per model
+        results = await run_analysis(images)
+        
+        # Frames of a session are folded into its temporal alerts in order
+        if session_id is not None:
+            for frame_results in results:
+                frame_results["session"] = session_alerts(alert_engine, session_id, frame_results)
+        
+        return JSONResponse(content={"results": results, "count": len(results)})
+        
+    except QueueFullError:
+        raise
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image file at index {e.args[0]}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+
+@app.websocket("/ws/session/{exam_id}")
+async def session_stream(websocket: WebSocket, exam_id: str):
+    """Stream binary JPEG frames of one exam session and receive results on the same connection"""
+    await websocket.accept()
+    session = sessions.setdefault(exam_id, SessionState(exam_id, alert_engine))
+    session.connections += 1
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is None:
+                await websocket.send_json({"error": "Frames must be sent as binary messages"})
+                continue
+            
+            try:
+                results = (await run_analysis([message["bytes"]], exam_id))[0]
+            except InvalidImageError:
+                await websocket.send_json({"error": "Invalid image file"})
+                continue
+            except QueueFullError as e:
+                # the frame is dropped, the client keeps streaming
+                await websocket.send_json({"error": "Analysis queue is full", "retry_after": e.retry_after})
+                continue
+            except FrameSupersededError:
+                # another connection of the same exam sent a newer frame
+                await websocket.send_json({"error": "Frame superseded by a newer frame of the same session"})
+                continue
+            
+            # Temporal alerts and identity are tracked per session
+            results["session"] = session.update(results)
+            await websocket.send_json(results)
+            
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # other connections of the same exam keep streaming with the state
+        session.connections -= 1
+        if session.connections == 0 and sessions.get(exam_id) is session:
+            del sessions[exam_id]
+            motion_gate.discard(exam_id)
+
 @app.get("/students")
 async def get_students():
     """Get list of registered students"""
@@ -211,6 +817,90 @@ async def get_students():
         "count": len(known_face_names)
     }
 
+# Extensions of the enrolled photos by image format
+PHOTO_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png"}
+
+def publish_face_index(face_index):
+    """Swap in the updated face index, or index the store again when another process also wrote it"""
+    if list(face_index.names) == student_store.names:
+        models.face_index = face_index
+        models.face_index_version = store_version(EMBEDDINGS_DIR)
+    else:
+        # e.g. enroll_students.py added photos, the store has them
+        models.refresh_face_index()
+
+def enroll_student(name, contents):
+    """Encode a student photo, save it in the student database and add the face to the index
+
+    The face is encoded outside of the enrollment lock, so concurrent
+    enrollments only wait for each other to update the store and publish
+    a new index. Returns the number of faces in the index.
+    """
+    global known_face_names
+    try:
+        photo = Image.open(BytesIO(contents))
+        extension = PHOTO_EXTENSIONS.get(photo.format)
+        pixels = np.array(photo.convert("RGB"))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid image file")
+    if extension is None:
+        raise HTTPException(status_code=400, detail="Photo must be a JPEG or PNG image")
+    encodings = face_recognition.face_encodings(pixels)
+    if len(encodings) == 0:
+        raise HTTPException(status_code=422, detail="No face found on the photo")
+    
+    with enrollment_lock:
+        if any(entry["name"] == name for entry in student_store.entries):
+            raise HTTPException(status_code=409, detail=f"Student '{name}' is already enrolled")
+        os.makedirs(STUDENT_DB_PATH, exist_ok=True)
+        file_name = name + extension
+        with open(os.path.join(STUDENT_DB_PATH, file_name), "wb") as f:
+            f.write(contents)
+        student_store.add(STUDENT_DB_PATH, file_name, encodings[0])
+        # copy on write: analyses running now keep the index they hold
+        publish_face_index(models.face_index.added([encodings[0]], [name]))
+        known_face_names = student_store.names
+        return len(models.face_index)
+
+def remove_student(name):
+    """Remove the photos and the face of a student, returns the number of faces left in the index"""
+    global known_face_names
+    with enrollment_lock:
+        removed = student_store.remove(name)
+        if not removed:
+            raise HTTPException(status_code=404, detail=f"Student '{name}' not found")
+        for file_name in removed:
+            try:
+                os.remove(os.path.join(STUDENT_DB_PATH, file_name))
+            except FileNotFoundError:
+                pass
+        publish_face_index(models.face_index.removed(name))
+        known_face_names = student_store.names
+        return len(models.face_index)
+
+def check_enrollment():
+    """Enrollment needs face_recognition and a loaded face index"""
+    if student_store is None or models.face_index is None:
+        raise HTTPException(status_code=503, detail="Face recognition is not available")
+
+@app.post("/students")
+async def add_student(name: str = Form(...), file: UploadFile = File(...)):
+    """Enroll a student from a photo, without restarting the server"""
+    check_enrollment()
+    # the name becomes the file name of the photo in the student database
+    if not name or name != name.strip() or set(name) & set("./\\"):
+        raise HTTPException(status_code=400, detail="Invalid student name")
+    contents = await file.read()
+    count = await asyncio.get_running_loop().run_in_executor(None, enroll_student, name, contents)
+    return JSONResponse(status_code=201, content={"name": name, "count": count})
+
+@app.delete("/students/{name}")
+async def delete_student(name: str):
+    """Remove an enrolled student"""
+    check_enrollment()
+    count = await asyncio.get_running_loop().run_in_executor(None, remove_student, name)
+    return {"name": name, "count": count}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=7860) 
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""
+Prometheus metrics of the proctoring API, served by GET /metrics.
+
+Stage timings are measured with perf_counter inside the analysis workers
+and returned with the results, so they are observed in the API process
+whichever executor runs the analysis.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Frame analysis stages range from sub-millisecond resizes to YOLO forwards
+# of a few hundred milliseconds on CPU
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+STAGE_LATENCY = Histogram(
+    "proctoring_stage_seconds",
+    "Time spent in each frame analysis stage per analysis call",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+QUEUE_WAIT = Histogram(
+    "proctoring_queue_wait_seconds",
+    "Time an analysis call waited for a free worker",
+    buckets=STAGE_BUCKETS,
+)
+ANALYSIS_LATENCY = Histogram(
+    "proctoring_analysis_seconds",
+    "End to end time of an analysis call, queue wait included",
+    buckets=STAGE_BUCKETS,
+)
+FRAMES_PROCESSED = Counter(
+    "proctoring_frames_processed_total",
+    "Frames analysed",
+)
+FRAMES_STATIC = Counter(
+    "proctoring_frames_static_total",
+    "Frames of a session that did not move and reused its last results",
+)
+FRAMES_DROPPED = Counter(
+    "proctoring_frames_dropped_total",
+    "Frames not analysed",
+    ["reason"],
+)
+INFERENCE_BATCH_SIZE = Histogram(
+    "proctoring_inference_batch_size",
+    "Inputs per batched forward of a shared model",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+IN_FLIGHT = Gauge(
+    "proctoring_requests_in_flight",
+    "Analysis calls queued or running",
+)
+
+
+def observe_timings(timings):
+    """Record the stage timings returned by an analysis worker"""
+    for stage, seconds in timings.items():
+        if stage == "queue_wait":
+            QUEUE_WAIT.observe(seconds)
+        else:
+            STAGE_LATENCY.labels(stage).observe(seconds)
@@ -0,0 +1,65 @@
+"""
+Per exam session state for the streaming endpoint.
+
+A session follows one student's webcam stream. Its temporal alert
+counters live in the shared AlertEngine, so single noisy frames do not
+raise alerts; the session itself keeps the identity verified at the start
+of the stream and the last face box.
+"""
+
+# An alert fires once its condition held on more than this many consecutive frames
+ALERT_THRESHOLD = 10
+
+# Condition checked on every frame for each temporal alert
+ALERT_CHECKS = {
+    "multiple_people": lambda results: results["people_count"] != 1,
+    "banned_objects": lambda results: len(results["banned_objects"]) > 0,
+    "no_face": lambda results: results["people_count"] == 1 and not results["face_detected"],
+    "unknown_face": lambda results: results["face_detected"] and results["person_name"] == "Unknown",
+    "spoofing": lambda results: results["spoofing_alert"],
+    "head_pose": lambda results: results["headpose_alert"],
+}
+
+def session_alerts(alert_engine, session_id, results):
+    """Advance the temporal alerts of a session with the analysis of a new frame"""
+    conditions = {check: bool(condition(results)) for check, condition in ALERT_CHECKS.items()}
+    alerts = alert_engine.update_many(session_id, conditions)
+    return {
+        "alert_frames": alert_engine.counters(session_id),
+        "alerts": alerts,
+    }
+
+class SessionState:
+    """State of one exam session, shared by the connections streaming it"""
+
+    def __init__(self, exam_id, alert_engine):
+        self.exam_id = exam_id
+        self.alert_engine = alert_engine
+        # open connections of the session, the state is dropped after the last one
+        self.connections = 0
+        self.frames = 0
+        self.identity = None
+        self.face_box = None
+
+    def update(self, results):
+        """Fold the analysis of a frame into the session and return its report"""
+        self.frames += 1
+        alerts = session_alerts(self.alert_engine, self.exam_id, results)
+
+        # The identity is verified once and kept while the same single
+        # person stays in front of the camera
+        if results["people_count"] != 1:
+            self.identity = None
+        elif results["face_detected"] and self.identity is None:
+            self.identity = results["person_name"]
+
+        if results["face_detected"]:
+            self.face_box = results["face_box"]
+
+        return {
+            "exam_id": self.exam_id,
+            "frames": self.frames,
+            "identity": self.identity,
+            "face_box": self.face_box,
+            **alerts,
+        }
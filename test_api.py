@@ -5,7 +5,11 @@ Simple test script for the Intelligent Online Exam Proctoring System API
 
 import requests
 import json
+import asyncio
+import websockets
 import base64
+import struct
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 
@@ -45,6 +49,70 @@ def test_students():
         print(f"Students endpoint failed: {e}")
         return False
 
+def test_enroll_student():
+    """Test enrolling and removing a student without restarting the server"""
+    try:
+        with open("Code/student_db/Barack Obama.jpg", "rb") as f:
+            photo = f.read()
+        
+        files = {'file': ('student.jpg', photo, 'image/jpeg')}
+        response = requests.post("http://localhost:7860/students", data={'name': 'Test Student'}, files=files)
+        print("\nEnroll Student:")
+        print(f"Status Code: {response.status_code}")
+        print(f"Response: {response.json()}")
+        if response.status_code == 503:
+            # face_recognition is not installed on the server
+            return True
+        
+        enrolled = 'Test Student' in requests.get("http://localhost:7860/students").json()["students"]
+        
+        response = requests.delete("http://localhost:7860/students/Test Student")
+        print(f"Delete Status Code: {response.status_code}")
+        print(f"Response: {response.json()}")
+        
+        return enrolled and response.status_code == 200
+    except Exception as e:
+        print(f"Enroll student test failed: {e}")
+        return False
+
+def test_stale_frames():
+    """Test that older queued frames of a session are superseded, not queued behind"""
+    try:
+        image = create_test_image()
+        _, buffer = cv2.imencode('.jpg', image)
+        
+        def send(_):
+            files = {'file': ('test.jpg', buffer.tobytes(), 'image/jpeg')}
+            return requests.post("http://localhost:7860/analyze_frame?session_id=test_stale", files=files)
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(send, range(8)))
+        
+        codes = [response.status_code for response in responses]
+        print("\nStale Frames:")
+        print(f"Status Codes: {codes}")
+        for response in responses:
+            if response.status_code == 429:
+                print(f"Retry-After: {response.headers.get('Retry-After')}")
+        # frames that reached a worker are analysed, the others are dropped
+        return all(code in (200, 409, 429) for code in codes) and 200 in codes
+    except Exception as e:
+        print(f"Stale frames test failed: {e}")
+        return False
+
+def test_metrics():
+    """Test Prometheus metrics endpoint"""
+    try:
+        response = requests.get("http://localhost:7860/metrics")
+        print("\nMetrics Endpoint:")
+        print(f"Status Code: {response.status_code}")
+        lines = [line for line in response.text.splitlines() if line.startswith("proctoring_") and "_bucket" not in line]
+        print("\n".join(lines))
+        return response.status_code == 200 and "proctoring_frames_processed_total" in response.text
+    except Exception as e:
+        print(f"Metrics endpoint failed: {e}")
+        return False
+
 def create_test_image():
     """Create a simple test image"""
     # Create a simple image with a face-like shape
@@ -90,6 +158,91 @@ def test_analyze_frame():
         print(f"Analyze frame test failed: {e}")
         return False
 
+def test_analyze_frame_binary():
+    """Test analyze_frame_binary endpoint"""
+    try:
+        img = create_test_image()
+        
+        # Encoded JPEG as the raw request body
+        _, buffer = cv2.imencode('.jpg', img)
+        response = requests.post("http://localhost:7860/analyze_frame_binary",
+                                 data=buffer.tobytes(),
+                                 headers={'Content-Type': 'image/jpeg'})
+        
+        print("\nAnalyze Frame (Binary JPEG):")
+        print(f"Status Code: {response.status_code}")
+        print(f"Response: {response.json()}")
+        jpeg_ok = response.status_code == 200
+        
+        # Raw BGR pixels behind the 8 byte header (FourCC, width, height)
+        header = struct.pack('<4sHH', b'BGR3', img.shape[1], img.shape[0])
+        response = requests.post("http://localhost:7860/analyze_frame_binary",
+                                 data=header + img.tobytes(),
+                                 headers={'Content-Type': 'application/octet-stream'})
+        
+        print("\nAnalyze Frame (Raw BGR):")
+        print(f"Status Code: {response.status_code}")
+        print(f"Response: {response.json()}")
+        raw_ok = response.status_code == 200
+        
+        # Raw frames without pixels are rejected as invalid
+        empty_ok = True
+        for fourcc in (b'BGR3', b'NV12'):
+            response = requests.post("http://localhost:7860/analyze_frame_binary",
+                                     data=struct.pack('<4sHH', fourcc, 0, 0),
+                                     headers={'Content-Type': 'application/octet-stream'})
+            print(f"\nAnalyze Frame (Empty {fourcc.decode()}): Status Code: {response.status_code}")
+            empty_ok = empty_ok and response.status_code == 400
+        
+        return jpeg_ok and raw_ok and empty_ok
+    except Exception as e:
+        print(f"Analyze frame binary test failed: {e}")
+        return False
+
+def test_analyze_frames():
+    """Test analyze_frames endpoint"""
+    try:
+        # Send a short burst of frames in one request
+        img = create_test_image()
+        _, buffer = cv2.imencode('.jpg', img)
+        img_bytes = buffer.tobytes()
+        
+        files = [('files', (f'frame_{i}.jpg', img_bytes, 'image/jpeg')) for i in range(5)]
+        response = requests.post("http://localhost:7860/analyze_frames", files=files)
+        
+        print("\nAnalyze Frames (Batch Upload):")
+        print(f"Status Code: {response.status_code}")
+        print(f"Response: {response.json()}")
+        
+        return response.status_code == 200 and response.json()["count"] == 5
+    except Exception as e:
+        print(f"Analyze frames test failed: {e}")
+        return False
+
+def test_session_stream():
+    """Test WebSocket session streaming endpoint"""
+    async def stream():
+        img = create_test_image()
+        _, buffer = cv2.imencode('.jpg', img)
+        
+        async with websockets.connect("ws://localhost:7860/ws/session/test_exam") as websocket:
+            # Send a few frames and read each result back on the same connection
+            for _ in range(3):
+                await websocket.send(buffer.tobytes())
+                result = json.loads(await websocket.recv())
+            return result
+    
+    try:
+        result = asyncio.run(stream())
+        
+        print("\nSession Stream (WebSocket):")
+        print(f"Response: {result}")
+        
+        return result["session"]["frames"] == 3
+    except Exception as e:
+        print(f"Session stream test failed: {e}")
+        return False
+
 def main():
     """Run all tests"""
     print("Testing Intelligent Online Exam Proctoring System API")
@@ -99,7 +252,13 @@ def main():
         ("Health Check", test_health),
         ("Root Endpoint", test_root),
         ("Students Endpoint", test_students),
+        ("Enroll Student", test_enroll_student),
         ("Analyze Frame", test_analyze_frame),
+        ("Analyze Frame Binary", test_analyze_frame_binary),
+        ("Analyze Frames", test_analyze_frames),
+        ("Session Stream", test_session_stream),
+        ("Stale Frames", test_stale_frames),
+        ("Metrics", test_metrics),
     ]
     
     results = []